@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+# JWT authentication without a user SELECT on every request.
+#
+# Tokens are still verified in full, only the user behind a valid token is cached,
+# for AUTH_USER_CACHE_TIMEOUT seconds in the default cache (bounded by its
+# MAX_ENTRIES). The entry holds just the fields requests and the checks below
+# read, never the password hash: with CHECK_REVOKE_TOKEN only its md5 digest,
+# which every access token carries anyway. Cached users are unsaved copies
+# rebuilt from those fields. Saving or deleting a user drops their entry
+# (accounts.signals), so deactivation and password changes apply from the next
+# request, on every worker when the cache is shared and at most a timeout later
+# otherwise. Refresh tokens don't go through here; refreshing keeps its
+# blacklist check.
+
+CACHED_FIELDS = ('is_active', 'is_staff', 'is_superuser')
+
+
+def user_cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+def _password_digest(user):
+    return get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None
+
+
+def _cached_user(fields, validated_token):
+    if fields is None:
+        return None
+    fields = dict(fields)
+    password_digest = fields.pop('password_digest')
+    user = get_user_model()(**fields)
+    user._state.adding, user._state.db = False, router.db_for_read(get_user_model())
+    return check_user(user, validated_token, password_digest)
+
+
+def _cache_fields(user):
+    fields = {field: getattr(user, field)
+              for field in (api_settings.USER_ID_FIELD, user.USERNAME_FIELD, *CACHED_FIELDS)}
+    fields['password_digest'] = _password_digest(user)
+    return fields
+
+
+def get_cached_user(user_id, validated_token):
+    """The cached user of ``user_id``, checked against ``validated_token``, None on a miss."""
+    return _cached_user(cache.get(user_cache_key(user_id)), validated_token)
+
+
+def cache_user(user):
+    cache.set(user_cache_key(getattr(user, api_settings.USER_ID_FIELD)), _cache_fields(user),
+              timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+# Async variants for the async views, so a network cache backend doesn't block the event loop
+
+
+async def aget_cached_user(user_id, validated_token):
+    return _cached_user(await cache.aget(user_cache_key(user_id)), validated_token)
+
+
+async def acache_user(user):
+    await cache.aset(user_cache_key(getattr(user, api_settings.USER_ID_FIELD)), _cache_fields(user),
+                     timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def forget_user(user):
+    cache.delete(user_cache_key(getattr(user, api_settings.USER_ID_FIELD)))
+
+
+def check_user(user, validated_token, password_digest=None):
+    """The checks JWTAuthentication runs on a freshly loaded user."""
+    if not user.is_active:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+    if api_settings.CHECK_REVOKE_TOKEN:
+        if password_digest is None:
+            password_digest = _password_digest(user)
+        if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_digest:
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(user_id, validated_token)
+        if user is None:
+            # Inactive users raise here and are never cached
+            user = super().get_user(validated_token)
+            cache_user(user)
+        return user
@@ -0,0 +1,14 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.authentication import forget_user
+
+
+# Users cached by CachedJWTAuthentication are reloaded after any change
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance)
@@ -1,3 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def test_user_is_loaded_once_until_it_changes(self):
+        with self.assertNumQueries(2):  # user, then meals
+            self.assertEqual(self.client.get('/api/meals/get_range/2024-01-01/2024-01-02/').status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/meals/get_range/2024-01-01/2024-01-02/').status_code, 200)
+        # No credentials in the shared cache
+        self.assertNotIn('password', cache.get(f'auth_user:{self.user.pk}'))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/meals/get_range/2024-01-01/2024-01-02/').status_code, 401)
+
+    def test_blacklisted_refresh_tokens_are_refused(self):
+        self.refresh.blacklist()
+        response = self.client.post('/api/token/refresh/', {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Ingredient, Recipe, Meal, IngredientAmount, Dish, ExtraItems
+from .models import Ingredient, Recipe, Meal, IngredientAmount, Dish, ExtraItems, IngredientPack
 
 
 class IngredientAmountInline(admin.TabularInline):
@@ -19,6 +19,15 @@ class ExtraItemsInline(admin.TabularInline):
     extra = 1
 
 
+class IngredientPackInline(admin.TabularInline):
+    model = IngredientPack
+    extra = 1
+
+
+class IngredientAdmin(admin.ModelAdmin):
+    inlines = (IngredientPackInline,)
+
+
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientAmountInline,)
 
@@ -27,6 +36,6 @@ class MealAdmin(admin.ModelAdmin):
     inlines = (DishInline, ExtraItemsInline,)
 
 
-admin.site.register(Ingredient)
+admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Meal, MealAdmin)
@@ -0,0 +1,81 @@
+from django.db.models import F, Sum
+
+from food_manager.models import ExtraItems, IngredientAmount, IngredientDemand
+from food_manager import units
+from food_manager.units import db_base_unit, db_factor
+
+# Set-based shopping list computation. Everything is pushed into the database as
+# grouped sums over Dish -> IngredientAmount and ExtraItems, so the number of
+# queries doesn't depend on how many meals or dishes are in the range.
+
+
+def dish_totals(meals, *group_by):
+    """Grouped ingredient totals of every dish served in ``meals``.
+
+    Each ingredient amount is scaled by ``amount / recipe.portions * dish.portions``
+    and converted to its base unit. Rows carry ``ingredient_pk``, ``name``,
+    ``density``, ``base_unit``, ``total`` and any extra ``group_by`` lookups
+    (relative to the dish's meal), each prefixed with ``meal_``.
+    """
+    factor, base_unit = db_factor('unit'), db_base_unit('unit')
+    group_by = {f'meal_{field}': F(f'recipe__dish__meal__{field}') for field in group_by}
+    return (IngredientAmount.objects
+            .filter(recipe__dish__meal__in=meals)
+            .annotate(ingredient_pk=F('ingredient_id'), name=F('ingredient__name'),
+                      density=F('ingredient__density'), base_unit=base_unit, **group_by)
+            .values('ingredient_pk', 'name', 'density', 'base_unit', *group_by)
+            .annotate(total=Sum(F('amount') / F('recipe__portions') * F('recipe__dish__portions') * factor))
+            .order_by())
+
+
+def extra_totals(meals, *group_by):
+    """Grouped totals of the extra items of ``meals``, same row shape as ``dish_totals``."""
+    factor, base_unit = db_factor('unit'), db_base_unit('unit')
+    group_by = {f'meal_{field}': F(f'meal__{field}') for field in group_by}
+    return (ExtraItems.objects
+            .filter(meal__in=meals)
+            .annotate(ingredient_pk=F('item_id'), name=F('item__name'),
+                      density=F('item__density'), base_unit=base_unit, **group_by)
+            .values('ingredient_pk', 'name', 'density', 'base_unit', *group_by)
+            .annotate(total=Sum(F('amount') * factor))
+            .order_by())
+
+
+def demand_totals(start_date, end_date, user=None):
+    """Range-sum over the precomputed ``IngredientDemand`` rows, same row shape as ``dish_totals``.
+
+    Sums every user's demand unless ``user`` is given.
+    """
+    demand = IngredientDemand.objects.filter(date__range=(start_date, end_date))
+    if user is not None:
+        demand = demand.filter(user=user)
+    return (demand
+            .annotate(ingredient_pk=F('ingredient_id'), name=F('ingredient__name'),
+                      density=F('ingredient__density'), base_unit=F('unit'))
+            .values('ingredient_pk', 'name', 'density', 'base_unit')
+            .annotate(total=Sum('amount'))
+            .order_by())
+
+
+def as_ingredient_list(*row_sets, merge=False):
+    """Fold total rows into ``{"<ingredient>, <unit>": amount}``.
+
+    With ``merge`` the volume totals of ingredients with a known density are
+    converted to mass, so each of them ends up under a single key. The density
+    comes with the rows, no extra query is made.
+    """
+    ingredient_list = {}
+    for rows in row_sets:
+        for row in rows:
+            unit, amount = row['base_unit'], row['total'] or 0.0
+            if merge:
+                unit, amount = units.to_mass(unit, amount, row['density'])
+            # Convert the tuple key to a string
+            ingredient_key = f"{row['name']}, {unit}"
+            ingredient_list[ingredient_key] = ingredient_list.get(ingredient_key, 0.0) + amount
+    return ingredient_list
+
+
+def shopping_list(meals):
+    """Return ``{"<ingredient>, <unit>": amount}`` for everything needed to cook ``meals``."""
+    return as_ingredient_list(dish_totals(meals), extra_totals(meals))
@@ -0,0 +1,148 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from accounts.authentication import acache_user, aget_cached_user, check_user
+from food_manager import caching
+from food_manager.aggregation import as_ingredient_list, demand_totals
+from food_manager.api.serializers import MealSerializer, serialize_recipe
+from food_manager.api.views import shopping_list_body
+from food_manager.models import Recipe, Meal
+from food_manager.tracing import span, traced
+
+# Async counterparts of the read endpoints, served under /api/async/.
+#
+# Under ASGI these run on the event loop: database work goes through the async ORM
+# and everything else (token checks, serialization of prefetched rows, the local
+# caches) is plain CPU work that never touches the database, so a slow client
+# holds a coroutine instead of a worker thread. DRF's @api_view is sync only, so
+# authentication and responses are done here by hand, with the same JWT tokens
+# and response bodies as the sync views.
+
+_jwt = JWTAuthentication()
+
+
+async def _authenticate(request):
+    """The user of the request's bearer token, None when there is no token."""
+    header = _jwt.get_header(request)
+    raw_token = _jwt.get_raw_token(header) if header is not None else None
+    if raw_token is None:
+        return None
+    token = _jwt.get_validated_token(raw_token)
+    if api_settings.USER_ID_CLAIM not in token:
+        raise InvalidToken('Token contained no recognizable user identification')
+
+    # Same user cache as the sync views
+    user_id = token[api_settings.USER_ID_CLAIM]
+    user = await aget_cached_user(user_id, token)
+    if user is not None:
+        return user
+    try:
+        user = await get_user_model().objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+    except get_user_model().DoesNotExist:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+    check_user(user, token)
+    await acache_user(user)
+    return user
+
+
+def authenticated(view):
+    """Async equivalent of ``@permission_classes([IsAuthenticated])`` with JWT authentication."""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            user = await _authenticate(request)
+        except (InvalidToken, AuthenticationFailed) as e:
+            return JsonResponse(e.detail, status=401)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _invalid_date():
+    return JsonResponse({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status=400)
+
+
+@require_GET
+@authenticated
+@traced('async_get_recipe')
+async def get_recipe(request, pk):
+    try:
+        recipe = await Recipe.objects.aget(pk=pk)
+        key = (recipe.pk, recipe.version)
+        data = await caching.recipe_representations.aget(key)
+        if data is None:
+            # Load the ingredient lines here, the serializer must not query on its own
+            recipe = await Recipe.objects.with_ingredients().aget(pk=pk)
+            data = serialize_recipe(recipe)
+            await caching.recipe_representations.aset(key, data)
+    except Recipe.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return JsonResponse(data)
+
+
+@require_GET
+@authenticated
+@traced('async_get_meal')
+async def get_meal(request, pk):
+    try:
+        meal = await Meal.objects.with_contents().aget(pk=pk, user=request.user)
+    except Meal.DoesNotExist:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    return JsonResponse(MealSerializer(meal).data)
+
+
+@require_GET
+@authenticated
+@traced('async_get_meals_between_dates')
+async def get_meals_between_dates(request, start_date, end_date):
+    try:
+        start_date = timezone.datetime.strptime(start_date, '%Y-%m-%d').date()
+        end_date = timezone.datetime.strptime(end_date, '%Y-%m-%d').date()
+    except ValueError:
+        return _invalid_date()
+
+    meals = Meal.objects.with_contents().filter(user=request.user, date__range=[start_date, end_date])
+    meals = [meal async for meal in meals]
+
+    with span('meals.serialize'):
+        data = MealSerializer(meals, many=True).data
+    return JsonResponse(data, safe=False)
+
+
+@require_GET
+@authenticated
+@traced('async_ingredient_list')
+async def ingredient_list(request, start_str, end_str):
+    try:
+        start_date = timezone.datetime.strptime(str(start_str), '%Y-%m-%d').date()
+        end_date = timezone.datetime.strptime(str(end_str), '%Y-%m-%d').date()
+    except ValueError:
+        return _invalid_date()
+
+    merge = request.GET.get('merge', '').lower() in ('1', 'true', 'yes')
+    mode = request.GET.get('mode')
+    if mode in ('net', 'packs'):
+        # Netting and pack pricing have no async path yet, they run in a worker thread
+        body = await sync_to_async(shopping_list_body)(request.user, start_date, end_date, mode=mode, merge=merge)
+        return JsonResponse(body)
+
+    # Same cache entries as the sync view
+    cache_key = await caching.ashopping_list_key(request.user.pk, start_date, end_date, 'merge' if merge else 'raw')
+    ingredients_list = await caching.aget_shopping_list(cache_key)
+    if ingredients_list is None:
+        with span('shopping_list.aggregate'):
+            rows = [row async for row in demand_totals(start_date, end_date, user=request.user)]
+            ingredients_list = as_ingredient_list(rows, merge=merge)
+        await caching.aset_shopping_list(cache_key, ingredients_list)
+
+    return JsonResponse({'ingredient_list': ingredients_list})
@@ -0,0 +1,70 @@
+import csv
+
+from rest_framework.utils.encoders import JSONEncoder
+
+from food_manager.aggregation import demand_totals
+from food_manager.api.serializers import MealSerializer
+
+# Row generators behind the streaming export endpoints. They walk the database with
+# QuerySet.iterator(), so memory stays flat however long the exported range is.
+
+MEAL_CSV_HEADER = ['meal_id', 'date', 'meal', 'recipe', 'recipe_portions', 'dish_portions',
+                   'ingredient', 'unit', 'amount']
+SHOPPING_LIST_CSV_HEADER = ['ingredient', 'unit', 'amount']
+
+
+class _Echo:
+    # File-like object for csv.writer that hands each row straight back
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(objects):
+    encoder = JSONEncoder()
+    for obj in objects:
+        yield encoder.encode(obj) + '\n'
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def meal_representations(meals, chunk_size):
+    # Same JSON as get_meals_between_dates, one meal at a time
+    for meal in meals.with_contents().iterator(chunk_size=chunk_size):
+        yield MealSerializer(meal).data
+
+
+def meal_rows(meals, chunk_size):
+    # One row per recipe ingredient of every dish, then one per extra item
+    for meal in meals.with_contents().iterator(chunk_size=chunk_size):
+        for dish in meal.dish_set.all():
+            recipe = dish.recipe
+            for ingredient_amount in recipe.ingredientamount_set.all():
+                yield [meal.id, meal.date.isoformat(), meal.meal, recipe.name, recipe.portions, dish.portions,
+                       ingredient_amount.ingredient.name, ingredient_amount.unit, ingredient_amount.amount]
+        for extra in meal.extraitems_set.all():
+            yield [meal.id, meal.date.isoformat(), meal.meal, '', '', '', extra.item.name, extra.unit, extra.amount]
+
+
+def shopping_list_rows(start_date, end_date, chunk_size, user=None):
+    # (ingredient, unit, amount), ingredients sharing a name are merged like in the ingredient_list dict
+    rows = demand_totals(start_date, end_date, user=user).order_by('name', 'base_unit')
+    current, total = None, 0.0
+    for row in rows.iterator(chunk_size=chunk_size):
+        key = (row['name'], row['base_unit'])
+        if key != current:
+            if current is not None:
+                yield [*current, total]
+            current, total = key, 0.0
+        total += row['total'] or 0.0
+    if current is not None:
+        yield [*current, total]
+
+
+def shopping_list_representations(rows):
+    for name, unit, amount in rows:
+        yield {'ingredient': f"{name}, {unit}", 'amount': amount}
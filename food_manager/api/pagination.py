@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination
+
+# Keyset pagination for the list endpoints. The cursor encodes the last position
+# seen, so every page is an indexed range scan from there: a deep page costs the
+# same as the first one, and rows inserted meanwhile never shift the pages.
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class MealCursorPagination(IdCursorPagination):
+    # A user has at most one meal per type and day, so date is nearly unique and
+    # served by the (user, date, meal) unique index
+    ordering = ('date', 'id')
+
+
+def paginated_response(request, queryset, serializer_class, paginator_class=IdCursorPagination):
+    paginator = paginator_class()
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(serializer_class(page, many=True).data)
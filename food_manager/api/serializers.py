@@ -1,7 +1,15 @@
+import json
+
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.functions import Lower
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
-from food_manager.models import Ingredient, Recipe, IngredientAmount, Meal, Dish, ExtraItems
+from food_manager import caching, demand, search, stock, tracing
+from food_manager.models import (Ingredient, Recipe, IngredientAmount, Meal, Dish, ExtraItems, StockEntry,
+                                 new_recipe_version)
+from food_manager.units import UNITS_CHOICES
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView
 
@@ -22,10 +30,174 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['username', 'password', 'email']
 
 
+def resolve_ingredients(names):
+    """Map ingredient names to Ingredient rows, creating the missing ones in a single batch.
+
+    A name that only differs from an existing one in case ("olive Oil") maps to
+    the existing row instead of creating a duplicate.
+    """
+    names = set(names)
+    lowered = {name.lower() for name in names}
+    # One lookup served by the Lower('name') index, exact matches win over case variants
+    by_name, by_lower = {}, {}
+    matches = Ingredient.objects.annotate(lower_name=Lower('name')).filter(lower_name__in=lowered).order_by('id')
+    for ingredient in matches:
+        by_name.setdefault(ingredient.name, ingredient)
+        by_lower.setdefault(ingredient.lower_name, ingredient)
+    ingredients = {name: by_name.get(name) or by_lower[name.lower()]
+                   for name in names if name in by_name or name.lower() in by_lower}
+    missing = Ingredient.objects.bulk_create([Ingredient(name=name) for name in names if name not in ingredients])
+    search.ingredients.update(missing)
+    for ingredient in missing:
+        ingredients[ingredient.name] = ingredient
+    return ingredients
+
+
+def reject_near_duplicates(index, name, instance=None, same_name_ok=False):
+    """Raise a ValidationError when ``name`` is too similar to the name of another row.
+
+    ``same_name_ok`` lets an identical name through, for serializers that look
+    rows up by name instead of creating new ones.
+    """
+    pk = getattr(instance, 'pk', None)
+    candidates = [match_pk for match_pk, other, _ in index.similar(name)
+                  if match_pk != pk and not (same_name_ok and other == name)]
+    if not candidates:
+        return
+    # The index can lag behind other processes, the database has the final word
+    clashes = sorted(other for other in index.model.objects.filter(pk__in=candidates).values_list('name', flat=True)
+                     if search.is_near_duplicate(name, other) and not (same_name_ok and other == name))
+    if clashes:
+        raise serializers.ValidationError(f'Too similar to existing name(s): {", ".join(clashes)}.')
+
+
+def save_ingredient_amounts(recipes_data):
+    """Create or update the IngredientAmount rows of several recipes at once.
+
+    ``recipes_data`` is a list of ``(recipe, ingredients_data)`` pairs, where
+    ``ingredients_data`` is validated ``IngredientAmountSerializer`` data. An
+    ingredient listed again for the same recipe overwrites its unit and amount.
+    """
+    lines = [(recipe, ia_data) for recipe, ingredients_data in recipes_data for ia_data in ingredients_data
+             if ia_data.get('ingredient', {}).get('name')]
+    if not lines:
+        return
+
+    with transaction.atomic(), tracing.span('recipe.save_ingredient_amounts', lines=len(lines)):
+        ingredients = resolve_ingredients(ia_data['ingredient']['name'] for _, ia_data in lines)
+        recipes = {recipe.pk for recipe, _ in lines}
+        existing = {(ia.recipe_id, ia.ingredient_id): ia for ia in IngredientAmount.objects.filter(recipe_id__in=recipes)}
+
+        to_create, to_update = {}, {}
+        for recipe, ia_data in lines:
+            ingredient = ingredients[ia_data['ingredient']['name']]
+            key = (recipe.pk, ingredient.pk)
+            ia_instance = existing.get(key) or to_create.get(key)
+            if ia_instance is None:
+                ia_instance = to_create[key] = IngredientAmount(recipe=recipe, ingredient=ingredient)
+            elif key in existing:
+                to_update[key] = ia_instance
+            ia_instance.unit = ia_data.get('unit', '')
+            ia_instance.amount = ia_data.get('amount', 0)
+
+        IngredientAmount.objects.bulk_create(to_create.values())
+        IngredientAmount.objects.bulk_update(to_update.values(), ['unit', 'amount'])
+
+        # Bulk writes skip the model signals that keep the demand table and recipe versions in sync
+        demand.mark_recipes_dirty(recipes)
+        version = Recipe.objects.filter(pk__in=recipes).bump_versions()
+        for recipe, _ in lines:
+            recipe.version = version
+
+
+def resolve_recipes(recipes_data):
+    """Map recipe names to Recipe rows for a list of validated ``RecipeSerializer`` data.
+
+    Existing recipes get the given instructions and portions, missing ones are
+    created together with their ingredients. Uses a constant number of queries.
+    When a name is listed twice the last entry wins.
+    """
+    by_name = {recipe_data['name']: recipe_data for recipe_data in recipes_data}
+    recipes = {recipe.name: recipe for recipe in Recipe.objects.filter(name__in=by_name)}
+
+    to_update = []
+    for name, recipe in recipes.items():
+        instructions = by_name[name].get('instructions', '')
+        portions = by_name[name].get('portions', 1)
+        if (recipe.instructions, recipe.portions) != (instructions, portions):
+            recipe.instructions, recipe.portions = instructions, portions
+            recipe.version = new_recipe_version()
+            to_update.append(recipe)
+
+    missing = [Recipe(name=name, instructions=recipe_data.get('instructions', ''),
+                      portions=recipe_data.get('portions', 1))
+               for name, recipe_data in by_name.items() if name not in recipes]
+
+    with transaction.atomic():
+        created = Recipe.objects.bulk_create(missing)
+        search.recipes.update(created)
+        Recipe.objects.bulk_update(to_update, ['instructions', 'portions', 'version'])
+        save_ingredient_amounts([(recipe, by_name[recipe.name].get('ingredients', [])) for recipe in created])
+        if to_update:
+            demand.mark_recipes_dirty([recipe.pk for recipe in to_update])
+
+    recipes.update((recipe.name, recipe) for recipe in created)
+    return recipes
+
+
+def save_meal_contents(meal, dishes_data, extras_data):
+    """Insert the dishes and extra items of ``meal`` in bulk.
+
+    A recipe listed twice for the same meal is stored once, with the last portions.
+    """
+    with transaction.atomic():
+        recipes = resolve_recipes([dish_data['recipe'] for dish_data in dishes_data if 'recipe' in dish_data])
+        dishes = {}
+        for dish_data in dishes_data:
+            recipe = recipes[dish_data['recipe']['name']]
+            dishes[recipe.pk] = Dish(meal=meal, recipe=recipe, portions=dish_data.get('portions', 1))
+
+        items = resolve_ingredients(extra_data['item']['name'] for extra_data in extras_data)
+        extras = [ExtraItems(meal=meal, item=items[extra_data['item']['name']], unit=extra_data['unit'],
+                             amount=extra_data['amount'])
+                  for extra_data in extras_data]
+
+        with tracing.span('meal.save_contents', dishes=len(dishes), extras=len(extras)):
+            Dish.objects.bulk_create(dishes.values())
+            ExtraItems.objects.bulk_create(extras)
+
+        # Bulk writes skip the model signals that keep the demand table in sync
+        demand.mark_meals_dirty([meal.pk])
+
+
+def serialize_recipe(recipe):
+    """RecipeSerializer data of ``recipe`` as plain dicts and lists, bypassing the cache.
+
+    Loads the ingredient lines when they aren't prefetched.
+    """
+    if 'ingredientamount_set' not in getattr(recipe, '_prefetched_objects_cache', {}):
+        prefetch_related_objects([recipe], Prefetch('ingredientamount_set',
+                                                    queryset=IngredientAmount.objects.select_related('ingredient')))
+    # Plain dicts and lists, the serializer's return types keep the serializer and instances alive
+    return json.loads(json.dumps(RecipeSerializer(recipe).data))
+
+
+def recipe_representation(recipe):
+    """RecipeSerializer data of ``recipe``, served from the representation cache."""
+    return caching.recipe_representations.get_or_compute((recipe.pk, recipe.version),
+                                                         lambda: serialize_recipe(recipe))
+
+
 class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
-        fields = ['id', 'name']
+        fields = ['id', 'name', 'density', 'energy_kcal', 'protein', 'fat', 'carbohydrates']
+
+    def validate_name(self, value):
+        # Only for ingredients added on their own, nested ones refer to existing rows by name
+        if self.parent is None:
+            reject_near_duplicates(search.ingredients, value, self.instance)
+        return value
 
 
 class IngredientAmountSerializer(serializers.ModelSerializer):
@@ -67,53 +239,41 @@ class RecipeSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ['id', 'name', 'instructions', 'ingredients', 'portions']
 
+    def validate_name(self, value):
+        # New recipes are looked up by exact name, so only a similar but different name is a duplicate
+        if self.parent is None:
+            reject_near_duplicates(search.recipes, value, self.instance, same_name_ok=self.instance is None)
+        return value
+
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients', [])
 
-        # Create or update the recipe based on its name
-        recipe_instance, created = Recipe.objects.get_or_create(
-            name=validated_data['name'],
-            defaults={
-                'instructions': validated_data.get('instructions', ''),
-                'portions': validated_data.get('portions', 1)  # Default value for portions
-            }
-        )
+        with transaction.atomic():
+            # Create or update the recipe based on its name
+            recipe_instance, created = Recipe.objects.get_or_create(
+                name=validated_data['name'],
+                defaults={
+                    'instructions': validated_data.get('instructions', ''),
+                    'portions': validated_data.get('portions', 1)  # Default value for portions
+                }
+            )
 
-        # Create or update each ingredient and its amount
-        for ia_data in ingredients_data:
-            ingredient_data = ia_data.pop('ingredient', {})
-            ingredient_instance, created = Ingredient.objects.get_or_create(**ingredient_data)
-            IngredientAmount.objects.create(recipe=recipe_instance, ingredient=ingredient_instance, **ia_data)
+            # Create or update every ingredient and its amount in a handful of batched queries
+            save_ingredient_amounts([(recipe_instance, ingredients_data)])
 
-        # Serialize the recipe along with its ingredients
-        serializer = RecipeSerializer(recipe_instance, context=self.context)
-        return serializer.data
+        return recipe_instance
 
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
         instance.instructions = validated_data.get('instructions', instance.instructions)
         instance.portions = validated_data.get('portions', instance.portions)
-        instance.save()
 
         ingredients_data = validated_data.get('ingredients', [])
 
-        # Update or create IngredientAmount instances
-        for ia_data in ingredients_data:
-            ingredient_data = ia_data.get('ingredient', {})
-            ingredient_name = ingredient_data.get('name')
-
-            # Check if ingredient name is provided
-            if ingredient_name:
-                ingredient, created = Ingredient.objects.get_or_create(name=ingredient_name)
-
-                ia_instance, ia_created = IngredientAmount.objects.update_or_create(
-                    recipe=instance,
-                    ingredient=ingredient,
-                    defaults={'unit': ia_data.get('unit', ''), 'amount': ia_data.get('amount', 0)}
-                )
-            else:
-                # Handle the case where ingredient name is not provided
-                ia_instance = None
+        with transaction.atomic():
+            instance.save()
+            # Update or create IngredientAmount instances, lines without an ingredient name are skipped
+            save_ingredient_amounts([(instance, ingredients_data)])
 
         return instance
 
@@ -122,7 +282,8 @@ class RecipeSerializer(serializers.ModelSerializer):
 
         # Check if the ingredientamount_set attribute exists
         if hasattr(instance, 'ingredientamount_set'):
-            # Include ingredients in the serialized data
+            # Include ingredients in the serialized data, served from the prefetch cache when the
+            # recipe was loaded through Recipe.objects.with_ingredients() or Meal.objects.with_contents()
             representation['ingredients'] = IngredientAmountSerializer(instance.ingredientamount_set.all(),
                                                                        many=True).data
         elif 'ingredients' in representation:
@@ -165,14 +326,8 @@ class DishSerializer(serializers.ModelSerializer):
         return Dish.objects.create(**validated_data)
 
     def to_representation(self, instance):
-        representation = super().to_representation(instance)
-
-        # Check if the recipe attribute exists
-        if hasattr(instance, 'recipe'):
-            # Include ingredients in the serialized data
-            representation['recipe'] = RecipeSerializer(instance.recipe).data
-
-        return representation
+        # The same recipe shows up in many dishes, serialize it once per version
+        return {'id': instance.id, 'recipe': recipe_representation(instance.recipe), 'portions': instance.portions}
 
 
 class ExtraItemsSerializer(serializers.ModelSerializer):
@@ -209,77 +364,40 @@ class MealSerializer(serializers.ModelSerializer):
         fields = ['id', 'date', 'meal', 'dishes', 'extras']
 
     def is_valid(self, raise_exception=False):
-        print("Entering is_valid method of MealSerializer")
-
-        for field_name, field in self.fields.items():
-            try:
-                value = self.initial_data[field_name]
-                print(f"Field: {field_name}, Value: {value}")
-            except KeyError:
-                pass
-
-        result = super().is_valid(raise_exception=raise_exception)
-        print(f"Validation result: {result}")
-        print("Exiting is_valid method of MealSerializer")
+        with tracing.span('meal.validate') as span:
+            result = super().is_valid(raise_exception=raise_exception)
+            span.set(valid=result)
         return result
 
-    def validate(self, data):
-        print("Entering validate method of MealSerializer")
-        validated_data = super().validate(data)
-        print("Exiting validate method of MealSerializer")
-        return validated_data
-
     def create(self, validated_data):
-        print("Entering create method of MealSerializer")
         dishes_data = validated_data.pop('dishes', [])
         extras_data = validated_data.pop('extras', [])
 
-        # Create the meal instance
-        meal = Meal.objects.create(**validated_data)
-        print("Meal instance created:", meal.id)
-
-        try:
-            # Create or update the Dish instances
-            for dish_data in dishes_data:
-                print("Processing dish_data:", dish_data)
-                recipe_data = dish_data.get('recipe', {})
-                if 'name' in recipe_data and not any(recipe_data.values()):
-                    # Reference existing recipe by name if available
-                    recipe_instance = Recipe.objects.get(name=recipe_data['name'])
-                else:
-                    # Create or update the associated recipe
-                    recipe_instance, created = Recipe.objects.update_or_create(name=recipe_data.get('name', ''),
-                                                                                defaults={'instructions': recipe_data.get('instructions', ''),
-                                                                                          'portions': recipe_data.get('portions', 1)})
-                print("Recipe instance created or updated:", recipe_instance.id)
-
-                dish_data['meal'] = meal
-                dish_data['recipe'] = recipe_instance
-
-                # Create or update Dish instance with proper association to Recipe and Meal
-                dish_instance, created = Dish.objects.update_or_create(
-                    meal=meal,
-                    recipe=recipe_instance,
-                    defaults={'portions': dish_data.get('portions', 1)}  # Default value for portions
-                )
-                print("Dish instance created or updated:", dish_instance.id)
-        except Exception as dish_error:
-            print(f"Error creating Dish: {dish_error}")
-
-        try:
-            # Create or update the ExtraItems instances
-            for extra_data in extras_data:
-                print("Processing extra_data:", extra_data)
-                item_data = extra_data.get('item', {})
-                item_instance, created = Ingredient.objects.update_or_create(**item_data)
-                extra_item_instance, created = ExtraItems.objects.create(meal=meal, item=item_instance, **extra_data)
-                print("ExtraItems instance created:", extra_item_instance.id)
-        except Exception as extras_error:
-            print(f"Error creating ExtraItems: {extras_error}")
-
-        print("Exiting create method of MealSerializer")
+        # The meal and everything in it are written together or not at all
+        with transaction.atomic():
+            with tracing.span('meal.create'):
+                meal = Meal.objects.create(**validated_data)
+            save_meal_contents(meal, dishes_data, extras_data)
+
         return meal
 
+    def update(self, instance, validated_data):
+        dishes_data = validated_data.pop('dishes', None)
+        extras_data = validated_data.pop('extras', None)
+
+        # Listed dishes and extras replace the current ones, omitted ones are kept
+        with transaction.atomic():
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            instance.save()
+            if dishes_data is not None:
+                instance.dish_set.all().delete()
+            if extras_data is not None:
+                instance.extraitems_set.all().delete()
+            save_meal_contents(instance, dishes_data or [], extras_data or [])
+
+        return instance
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
 
@@ -292,4 +410,49 @@ class MealSerializer(serializers.ModelSerializer):
             # Include extras in the serialized data
             representation['extras'] = ExtraItemsSerializer(instance.extraitems_set.all(), many=True).data
 
-        return representation
\ No newline at end of file
+        return representation
+
+
+class MealCloneSerializer(serializers.Serializer):
+    source_start = serializers.DateField()
+    source_end = serializers.DateField()
+    target_start = serializers.DateField()
+    repeat = serializers.IntegerField(min_value=1, max_value=366, default=1)
+
+    def validate(self, data):
+        if data['source_end'] < data['source_start']:
+            raise serializers.ValidationError('source_end must not be before source_start.')
+        return data
+
+
+class MealShiftSerializer(serializers.Serializer):
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+    days = serializers.IntegerField()
+
+    def validate(self, data):
+        if data['end_date'] < data['start_date']:
+            raise serializers.ValidationError('end_date must not be before start_date.')
+        return data
+
+
+class StockEntrySerializer(serializers.ModelSerializer):
+    ingredient = IngredientSerializer()
+    unit = serializers.ChoiceField(choices=UNITS_CHOICES)
+    quantity = serializers.FloatField()
+
+    class Meta:
+        model = StockEntry
+        fields = ['id', 'ingredient', 'unit', 'quantity', 'direction', 'created_at']
+        read_only_fields = ['created_at']
+
+    def validate_quantity(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('Quantity must be greater than zero.')
+        return value
+
+    def create(self, validated_data):
+        # Stored in the normalised unit, together with the user's running balance
+        name = validated_data.pop('ingredient')['name']
+        ingredient = resolve_ingredients([name])[name]
+        return stock.record(ingredient=ingredient, **validated_data)
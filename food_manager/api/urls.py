@@ -1,6 +1,6 @@
 from django.urls import path
 from django.urls import re_path
-from . import views
+from . import async_views, views
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView, TokenVerifyView
 
 urlpatterns = [
@@ -9,18 +9,39 @@ urlpatterns = [
     path('token/', TokenObtainPairView.as_view()),
     path('token/refresh/', TokenRefreshView.as_view()),
     path('token/verify/', TokenVerifyView.as_view()),
+    path('recipes/list/', views.list_recipes),
+    path('recipes/search/', views.search_recipes),
     path('recipes/add/', views.add_recipe),
     path('recipes/get/<int:pk>/', views.get_recipe),
     path('recipes/update/<int:pk>/', views.update_recipe),
     path('recipes/delete/<int:pk>/', views.delete_recipe),
+    path('ingredients/list/', views.list_ingredients),
+    path('ingredients/search/', views.search_ingredients),
     path('ingredients/add/', views.add_ingredient),
     path('ingredients/get/<int:pk>/', views.get_ingredient),
     path('ingredients/update/<int:pk>/', views.update_ingredient),
     path('ingredients/delete/<int:pk>/', views.delete_ingredient),
+    path('meals/list/', views.list_meals),
     path('meals/add/', views.add_meal),
     path('meals/get/<int:pk>/', views.get_meal),
-    # path('meals/update/<int:pk>/', views.update_meal),
-    # path('meals/delete/<int:pk>/', views.delete_meal),
+    path('meals/clone/', views.clone_meals),
+    path('meals/update/<int:pk>/', views.update_meal),
+    path('meals/delete/<int:pk>/', views.delete_meal),
     path('meals/get_range/<str:start_date>/<str:end_date>/', views.get_meals_between_dates),
-    path('meals/get_shopping_list/<str:start_str>/<str:end_str>/', views.ingredient_list)
+    path('meals/delete_range/<str:start_date>/<str:end_date>/', views.delete_meals_between_dates),
+    path('meals/shift/', views.shift_meals),
+    path('meals/get_shopping_list/<str:start_str>/<str:end_str>/', views.ingredient_list),
+    path('meals/nutrition/<str:start_date>/<str:end_date>/', views.meal_nutrition),
+    path('meals/export_range/<str:start_date>/<str:end_date>/<str:export_format>/',
+         views.export_meals_between_dates),
+    path('meals/export_shopping_list/<str:start_str>/<str:end_str>/<str:export_format>/',
+         views.export_ingredient_list),
+    path('stock/add/', views.add_stock_entry),
+    path('stock/get/', views.get_stock),
+    path('bulk/import/', views.bulk_import),
+    # Async versions of the read endpoints, for ASGI deployments
+    path('async/recipes/get/<int:pk>/', async_views.get_recipe),
+    path('async/meals/get/<int:pk>/', async_views.get_meal),
+    path('async/meals/get_range/<str:start_date>/<str:end_date>/', async_views.get_meals_between_dates),
+    path('async/meals/get_shopping_list/<str:start_str>/<str:end_str>/', async_views.ingredient_list),
 ]
@@ -1,15 +1,24 @@
 from django.contrib.auth import get_user_model
-from food_manager.models import Ingredient, Recipe, Meal
+from food_manager.models import Ingredient, Recipe, Meal, StockBalance
 from rest_framework.decorators import api_view, permission_classes, APIView
 from rest_framework.response import Response
 from food_manager.api.serializers import *
-from rest_framework import status
+from rest_framework import serializers, status
 from django.shortcuts import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.utils import timezone
 from collections import defaultdict
-from django.db import IntegrityError
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, IntegrityError, transaction
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+import json
+from food_manager import caching, nutrition, packs, planning, search, stock
+from food_manager.aggregation import as_ingredient_list, demand_totals
+from food_manager.tracing import span, traced
+from food_manager.api import exports
+from food_manager.api.pagination import MealCursorPagination, paginated_response
 
 
 # Create your views here.
@@ -40,16 +49,42 @@ def register(request):
 
 # ingredient views (TODO maybe convert to class-based)
 
+def _search_response(request, index):
+    # ?q= is the typed text, ?limit= caps the number of matches (at most 50)
+    try:
+        limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+    except ValueError:
+        return Response({"detail": "limit must be an integer."}, status.HTTP_400_BAD_REQUEST)
+    matches = index.search(request.query_params.get('q', ''), limit=limit)
+    return Response({'results': [{'id': pk, 'name': name, 'score': score} for pk, name, score in matches]})
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced('get_ingredient')
 def get_ingredient(request, pk):
     ingredient = get_object_or_404(Ingredient, pk=pk)
     serializer = IngredientSerializer(ingredient)
     return Response(serializer.data, status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('list_ingredients')
+def list_ingredients(request):
+    return paginated_response(request, Ingredient.objects.all(), IngredientSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('search_ingredients')
+def search_ingredients(request):
+    return _search_response(request, search.ingredients)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@traced('add_ingredient')
 def add_ingredient(request):
     serializer = IngredientSerializer(data=request.data)
     if serializer.is_valid():
@@ -58,11 +93,9 @@ def add_ingredient(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-# TODO add validation somewhere that makes sure that names aren't too similar
-
-
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
+@traced('update_ingredient')
 def update_ingredient(request, pk):
     ingredient = get_object_or_404(Ingredient, pk=pk)
     serializer = IngredientSerializer(instance=ingredient, data=request.data)
@@ -74,6 +107,7 @@ def update_ingredient(request, pk):
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
+@traced('delete_ingredient')
 def delete_ingredient(request, pk):
     ingredient = get_object_or_404(Ingredient, pk=pk)
     ingredient.delete()
@@ -84,39 +118,55 @@ def delete_ingredient(request, pk):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced('get_recipe')
 def get_recipe(request, pk):
+    # The ingredient lines are only loaded when the cache has no copy of this version
     recipe = get_object_or_404(Recipe, pk=pk)
-    serializer = RecipeSerializer(recipe)
-    return Response(serializer.data, status.HTTP_200_OK)
+    return Response(recipe_representation(recipe), status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('list_recipes')
+def list_recipes(request):
+    return paginated_response(request, Recipe.objects.with_ingredients(), RecipeSerializer)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('search_recipes')
+def search_recipes(request):
+    return _search_response(request, search.recipes)
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@traced('add_recipe')
 def add_recipe(request):
-    print(request.data)
     serializer = RecipeSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
-        serializer.save()
-        return Response({'id': serializer.data['id']}, status.HTTP_201_CREATED)
+        recipe = serializer.save()
+        return Response({'id': recipe.id}, status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-# TODO add validation somewhere that makes sure that names aren't too similar
-
-
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
+@traced('update_recipe')
 def update_recipe(request, pk):
     recipe = get_object_or_404(Recipe, pk=pk)
     serializer = RecipeSerializer(instance=recipe, data=request.data)
     if serializer.is_valid():
-        serializer.save()
-        return Response(serializer.data, status.HTTP_200_OK)
+        recipe = serializer.save()
+        # Reload with the ingredients prefetched to answer with the full recipe
+        recipe = Recipe.objects.with_ingredients().get(pk=recipe.pk)
+        return Response(RecipeSerializer(recipe).data, status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
+@traced('delete_recipe')
 def delete_recipe(request, pk):
     recipe = get_object_or_404(Recipe, pk=pk)
     recipe.delete()
@@ -125,15 +175,22 @@ def delete_recipe(request, pk):
 
 # meal views
 
+def _parse_date_range(start_str, end_str):
+    start_date = timezone.datetime.strptime(str(start_str), '%Y-%m-%d').date()
+    end_date = timezone.datetime.strptime(str(end_str), '%Y-%m-%d').date()
+    return start_date, end_date
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@traced('add_meal')
 def add_meal(request):
     try:
         # Attempt to create a new meal
         serializer = MealSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
-            serializer.save(user=request.user)
-            return Response({"id": serializer.data['id']}, status=status.HTTP_201_CREATED)
+            meal = serializer.save(user=request.user)
+            return Response({"id": meal.id}, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -148,11 +205,30 @@ def add_meal(request):
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@traced('clone_meals')
+def clone_meals(request):
+    serializer = MealCloneSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # Copies the whole range in bulk, nothing is written if any target slot is taken
+    try:
+        with span('meals.clone', repeat=serializer.validated_data['repeat']):
+            created = planning.clone_meals(request.user, **serializer.validated_data)
+    except planning.MealConflictError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(created, status=status.HTTP_201_CREATED)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced('get_meal')
 def get_meal(request, pk):
     # Retrieve the Meal instance or return 404 if not found
-    meal = get_object_or_404(Meal, pk=pk, user=request.user)
+    meal = get_object_or_404(Meal.objects.with_contents(), pk=pk, user=request.user)
 
     # Serialize the Meal instance
     serializer = MealSerializer(meal)
@@ -161,8 +237,36 @@ def get_meal(request, pk):
     return Response(serializer.data)
 
 
+@api_view(['PUT', 'PATCH'])
+@permission_classes([IsAuthenticated])
+@traced('update_meal')
+def update_meal(request, pk):
+    meal = get_object_or_404(Meal, pk=pk, user=request.user)
+    serializer = MealSerializer(instance=meal, data=request.data, partial=request.method == 'PATCH')
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        meal = serializer.save()
+    except IntegrityError:
+        return Response({'error': 'You can not plan meals for the same time!'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Reload with the contents prefetched to answer with the full meal
+    meal = Meal.objects.with_contents().get(pk=meal.pk)
+    return Response(MealSerializer(meal).data, status.HTTP_200_OK)
+
+
+@api_view(['DELETE'])
+@permission_classes([IsAuthenticated])
+@traced('delete_meal')
+def delete_meal(request, pk):
+    meal = get_object_or_404(Meal, pk=pk, user=request.user)
+    meal.delete()
+    return Response({"message": "Meal deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced('get_meals_between_dates')
 def get_meals_between_dates(request, start_date, end_date):
     try:
         start_date = timezone.datetime.strptime(start_date, '%Y-%m-%d').date()
@@ -171,17 +275,80 @@ def get_meals_between_dates(request, start_date, end_date):
         return Response({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status.HTTP_400_BAD_REQUEST)
 
     # Retrieve meals between the given dates for the authenticated user
-    meals = Meal.objects.filter(user=request.user, date__range=[start_date, end_date])
+    meals = Meal.objects.with_contents().filter(user=request.user, date__range=[start_date, end_date])
 
     # Serialize the meals
-    serializer = MealSerializer(meals, many=True)
+    with span('meals.serialize'):
+        data = MealSerializer(meals, many=True).data
 
     # Return the serialized data in the response
-    return Response(serializer.data)
+    return Response(data)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@traced('list_meals')
+def list_meals(request):
+    # Optional ?start_date= and ?end_date= narrow the listing
+    meals = Meal.objects.with_contents().filter(user=request.user)
+    try:
+        if request.query_params.get('start_date'):
+            meals = meals.filter(date__gte=timezone.datetime.strptime(request.query_params['start_date'],
+                                                                      '%Y-%m-%d').date())
+        if request.query_params.get('end_date'):
+            meals = meals.filter(date__lte=timezone.datetime.strptime(request.query_params['end_date'],
+                                                                      '%Y-%m-%d').date())
+    except ValueError:
+        return Response({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status.HTTP_400_BAD_REQUEST)
+
+    with span('meals.serialize'):
+        return paginated_response(request, meals, MealSerializer, MealCursorPagination)
+
+
+def _priced_shopping_list(user, start_date, end_date):
+    # Cached like the plain lists, pack changes invalidate every user's entries
+    cache_key = caching.shopping_list_key(user.pk, start_date, end_date, 'packs')
+    body = caching.get_shopping_list(cache_key)
+    if body is None:
+        rows = list(demand_totals(start_date, end_date, user=user))
+        with span('shopping_list.packs', rows=len(rows)):
+            plan, unpriced = packs.pack_plan(rows)
+        body = {
+            'ingredient_list': as_ingredient_list(rows, merge=True),
+            'packs': plan,
+            'unpriced': unpriced,
+            'total_cost': round(sum(item['cost'] for item in plan.values()), 2),
+        }
+        caching.set_shopping_list(cache_key, body)
+    return body
+
+
+def shopping_list_body(user, start_date, end_date, mode=None, merge=False):
+    """Response body of the shopping list endpoints, sync and async alike."""
+    # mode=packs prices the merged list in the cheapest pack sizes
+    if mode == 'packs':
+        return _priced_shopping_list(user, start_date, end_date)
+    # mode=net leaves out what is already in stock
+    net = mode == 'net'
+
+    # Cached per user and range, invalidated whenever the user's demand or stock changes
+    variant = ('net-' if net else '') + ('merge' if merge else 'raw')
+    cache_key = caching.shopping_list_key(user.pk, start_date, end_date, variant)
+    ingredients_list = caching.get_shopping_list(cache_key)
+    if ingredients_list is None:
+        with span('shopping_list.aggregate', net=net):
+            if net:
+                rows = demand_totals(start_date, end_date, user=user)
+                ingredients_list = stock.net_of_stock(rows, user, merge=merge)
+            else:
+                ingredients_list = Meal.extract_ingredient_list(start_date, end_date, merge=merge, user=user)
+        caching.set_shopping_list(cache_key, ingredients_list)
+    return {'ingredient_list': ingredients_list}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('ingredient_list')
 def ingredient_list(request, start_str, end_str):
     if not start_str or not end_str:
         return Response({'error': 'Both start_date and end_date are required'}, status.HTTP_400_BAD_REQUEST)
@@ -191,12 +358,227 @@ def ingredient_list(request, start_str, end_str):
     except ValueError:
         raise ValueError("Invalid date format. Please use YYYY-MM-DD.")
     try:
-        print(start_date, end_date)
-        ingredients_list = Meal.extract_ingredient_list(start_date, end_date)
-
-        return Response({'ingredient_list': ingredients_list})
+        # ?merge=1 converts volumes to mass for ingredients with a known density
+        merge = request.query_params.get('merge', '').lower() in ('1', 'true', 'yes')
+        return Response(shopping_list_body(request.user, start_date, end_date,
+                                           mode=request.query_params.get('mode'), merge=merge))
 
     except ValueError as e:
         return Response({"detail": str(e)}, status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _nutrient_sum(rows):
+    return {nutrient: round(sum(row[nutrient] for row in rows), 1) for nutrient in nutrition.NUTRIENTS}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('meal_nutrition')
+def meal_nutrition(request, start_date, end_date):
+    try:
+        start_date, end_date = _parse_date_range(start_date, end_date)
+    except ValueError:
+        return Response({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status.HTTP_400_BAD_REQUEST)
+
+    meals = Meal.objects.filter(user=request.user, date__range=(start_date, end_date))
+    with span('meals.nutrition'):
+        totals, incomplete = nutrition.rollup(meals)
+
+    empty = dict.fromkeys(nutrition.NUTRIENTS, 0.0)
+    meal_rows, days = [], defaultdict(list)
+    for pk, day, meal in meals.in_day_order().values_list('id', 'date', 'meal'):
+        row = {'id': pk, 'date': day, 'meal': meal, **totals.get(pk, empty)}
+        meal_rows.append(row)
+        days[str(day)].append(row)
+
+    return Response({
+        'meals': [{**row, **_nutrient_sum([row])} for row in meal_rows],
+        'days': {day: _nutrient_sum(rows) for day, rows in days.items()},
+        'total': _nutrient_sum(meal_rows),
+        'incomplete': incomplete,
+    })
+
+
+@api_view(['DELETE'])
+@permission_classes([IsAuthenticated])
+@traced('delete_meals_between_dates')
+def delete_meals_between_dates(request, start_date, end_date):
+    try:
+        start_date, end_date = _parse_date_range(start_date, end_date)
+    except ValueError:
+        return Response({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status.HTTP_400_BAD_REQUEST)
+
+    with span('meals.delete_range'):
+        deleted = planning.delete_meals(request.user, start_date, end_date)
+    return Response({'deleted': deleted}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@traced('shift_meals')
+def shift_meals(request):
+    serializer = MealShiftSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        with span('meals.shift', days=serializer.validated_data['days']):
+            moved = planning.shift_meals(request.user, **serializer.validated_data)
+    except planning.MealConflictError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'moved': moved}, status=status.HTTP_200_OK)
+
+
+# streaming exports
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('export_meals_between_dates')
+def export_meals_between_dates(request, start_date, end_date, export_format):
+    """Stream the meals of a date range as CSV or NDJSON.
+
+    Staff users can pass ``?all_users=1`` to export every user's meals.
+    """
+    if export_format not in EXPORT_FORMATS:
+        return Response({"detail": "Unknown export format, use csv or ndjson."}, status.HTTP_400_BAD_REQUEST)
+    try:
+        start_date, end_date = _parse_date_range(start_date, end_date)
+    except ValueError:
+        return Response({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status.HTTP_400_BAD_REQUEST)
+
+    meals = Meal.objects.filter(date__range=[start_date, end_date]).order_by('date', 'id')
+    if not (request.user.is_staff and request.query_params.get('all_users')):
+        meals = meals.filter(user=request.user)
+
+    if export_format == 'csv':
+        lines = exports.csv_lines(exports.MEAL_CSV_HEADER, exports.meal_rows(meals, settings.EXPORT_CHUNK_SIZE))
+    else:
+        lines = exports.ndjson_lines(exports.meal_representations(meals, settings.EXPORT_CHUNK_SIZE))
+    return StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('export_ingredient_list')
+def export_ingredient_list(request, start_str, end_str, export_format):
+    """Stream the shopping list of a date range as CSV or NDJSON, one ingredient per line.
+
+    Staff users can pass ``?all_users=1`` to export the demand of every user.
+    """
+    if export_format not in EXPORT_FORMATS:
+        return Response({"detail": "Unknown export format, use csv or ndjson."}, status.HTTP_400_BAD_REQUEST)
+    try:
+        start_date, end_date = _parse_date_range(start_str, end_str)
+    except ValueError:
+        return Response({"detail": "Invalid date format. Please use YYYY-MM-DD."}, status.HTTP_400_BAD_REQUEST)
+
+    user = None if request.user.is_staff and request.query_params.get('all_users') else request.user
+    rows = exports.shopping_list_rows(start_date, end_date, settings.EXPORT_CHUNK_SIZE, user=user)
+    if export_format == 'csv':
+        lines = exports.csv_lines(exports.SHOPPING_LIST_CSV_HEADER, rows)
+    else:
+        lines = exports.ndjson_lines(exports.shopping_list_representations(rows))
+    return StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+
+
+# bulk import
+
+IMPORT_SERIALIZERS = {
+    'recipe': RecipeSerializer,
+    'meal': MealSerializer,
+}
+
+
+def _import_line(request, line_number, raw_line):
+    # Validate and save a single NDJSON line, return its result entry
+    try:
+        entry = json.loads(raw_line)
+        kind, data = entry['type'], entry['data']
+        serializer_class = IMPORT_SERIALIZERS[kind]
+    except (ValueError, TypeError, KeyError):
+        return {'line': line_number, 'status': 'error',
+                'errors': {'detail': 'Expected {"type": "recipe" | "meal", "data": {...}}'}}
+
+    serializer = serializer_class(data=data, context={'request': request})
+    if not serializer.is_valid():
+        return {'line': line_number, 'type': kind, 'status': 'error', 'errors': serializer.errors}
+    try:
+        # Savepoint per line, so one bad line doesn't roll back the rest of its chunk
+        with transaction.atomic():
+            instance = serializer.save(user=request.user) if kind == 'meal' else serializer.save()
+    except serializers.ValidationError as e:
+        return {'line': line_number, 'type': kind, 'status': 'error', 'errors': e.detail}
+    except (DatabaseError, ObjectDoesNotExist, Http404) as e:
+        # Reported like any other bad line, the response is already streaming
+        return {'line': line_number, 'type': kind, 'status': 'error', 'errors': {'detail': str(e)}}
+    return {'line': line_number, 'type': kind, 'status': 'created', 'id': instance.id}
+
+
+def _import_chunk(request, chunk):
+    with transaction.atomic():
+        results = [_import_line(request, line_number, raw_line) for line_number, raw_line in chunk]
+    for result in results:
+        yield json.dumps(result) + '\n'
+
+
+def _import_stream(request, chunk_size):
+    # Read the body line by line from the underlying Django request (request.data would
+    # read it all at once), only ever holding one chunk of lines in memory
+    chunk = []
+    for line_number, raw_line in enumerate(request._request, start=1):
+        if not raw_line.strip():
+            continue
+        chunk.append((line_number, raw_line))
+        if len(chunk) >= chunk_size:
+            yield from _import_chunk(request, chunk)
+            chunk = []
+    if chunk:
+        yield from _import_chunk(request, chunk)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@traced('bulk_import')
+def bulk_import(request):
+    """Import recipes and meals from an NDJSON body, one ``{"type": ..., "data": ...}`` object per line.
+
+    Lines are committed in chunks of ``?chunk_size=`` (default ``BULK_IMPORT_CHUNK_SIZE``) and
+    the per-line results are streamed back as NDJSON while the body is still being read.
+    """
+    try:
+        chunk_size = int(request.query_params.get('chunk_size', settings.BULK_IMPORT_CHUNK_SIZE))
+    except ValueError:
+        chunk_size = 0
+    if chunk_size < 1:
+        return Response({"detail": "chunk_size must be a positive integer."}, status.HTTP_400_BAD_REQUEST)
+
+    return StreamingHttpResponse(_import_stream(request, chunk_size), content_type='application/x-ndjson')
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@traced('add_stock_entry')
+def add_stock_entry(request):
+    serializer = StockEntrySerializer(data=request.data)
+    if serializer.is_valid():
+        serializer.save(user=request.user)
+        return Response(serializer.data, status.HTTP_201_CREATED)
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@traced('get_stock')
+def get_stock(request):
+    # Read from the running balances, never from the ledger
+    balances = (StockBalance.objects.filter(user=request.user).exclude(amount=0)
+                .values_list('ingredient__name', 'unit', 'amount').order_by('ingredient__name', 'unit'))
+    return Response({'stock': {f'{name}, {unit}': amount for name, unit, amount in balances}})
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class FoodManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'food_manager'
+
+    def ready(self):
+        from food_manager import signals  # noqa: F401
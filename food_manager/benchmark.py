@@ -0,0 +1,169 @@
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from food_manager.models import Ingredient, Recipe, IngredientAmount, Meal, Dish
+
+# Helpers for the benchmark management commands: a throwaway database, a synthetic
+# catering dataset generator, timed endpoint runs through the test client and
+# latency summaries. The dataset is deterministic, so runs on different commits
+# measure the same work.
+
+START_DATE = date(2024, 1, 1)
+
+
+@contextmanager
+def throwaway_database():
+    """Run the block against a freshly migrated test database, like the test runner does."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def generate(users=1, recipes=20, ingredients_per_recipe=5, meals_per_day=4, days=30, dishes_per_meal=1,
+             batch_size=5000):
+    """Fill the database with a synthetic catering dataset using bulk inserts.
+
+    Every user plans ``meals_per_day`` meals (at most one per meal type) on each of
+    ``days`` days from ``START_DATE``, each with ``dishes_per_meal`` dishes picked
+    round-robin from a shared pool of ``recipes`` recipes.
+    """
+    meal_types = [code for code, _ in Meal.MEAL_CHOICES][:meals_per_day]
+
+    user_model = get_user_model()
+    user_model.objects.bulk_create(
+        [user_model(username=f'bench_user_{number}') for number in range(users)], batch_size=batch_size
+    )
+    user_ids = list(user_model.objects.filter(username__startswith='bench_user_').values_list('id', flat=True))
+
+    ingredient_pool = Ingredient.objects.bulk_create(
+        [Ingredient(name=f'Ingredient {number}') for number in range(recipes * ingredients_per_recipe // 2 + 1)],
+        batch_size=batch_size,
+    )
+    recipe_pool = Recipe.objects.bulk_create(
+        [Recipe(name=f'Recipe {number}', instructions='Cook', portions=4) for number in range(recipes)],
+        batch_size=batch_size,
+    )
+    IngredientAmount.objects.bulk_create(
+        [IngredientAmount(recipe=recipe, ingredient=ingredient_pool[(number + line) % len(ingredient_pool)],
+                          unit='gr', amount=100)
+         for number, recipe in enumerate(recipe_pool) for line in range(ingredients_per_recipe)],
+        batch_size=batch_size,
+    )
+
+    meals = [Meal(user_id=user_id, date=START_DATE + timedelta(days=day), meal=meal_type)
+             for user_id in user_ids for day in range(days) for meal_type in meal_types]
+    for start in range(0, len(meals), batch_size):
+        batch = Meal.objects.bulk_create(meals[start:start + batch_size])
+        Dish.objects.bulk_create(
+            [Dish(meal=meal, recipe=recipe_pool[(meal.pk + number) % len(recipe_pool)], portions=2)
+             for meal in batch for number in range(dishes_per_meal)]
+        )
+
+    return {
+        'users': users, 'recipes': recipes, 'ingredients_per_recipe': ingredients_per_recipe,
+        'meals_per_day': len(meal_types), 'days': days, 'dishes_per_meal': dishes_per_meal, 'meals': len(meals),
+    }
+
+
+def measure(func, repeat=5):
+    """Call ``func`` ``repeat`` times, return the latencies in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarise(samples):
+    return {
+        'runs': len(samples),
+        'min_ms': round(min(samples), 3),
+        'p50_ms': round(statistics.median(samples), 3),
+        'p90_ms': round(percentile(samples, 0.9), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+        'max_ms': round(max(samples), 3),
+    }
+
+
+def timed_calls(func, repeat=5):
+    """Call ``func(run_number)`` ``repeat`` times, return its latency summary and query counts."""
+    samples, query_counts = [], []
+    for run in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            func(run)
+            samples.append((time.perf_counter() - started) * 1000)
+        query_counts.append(len(queries))
+    return {**summarise(samples), 'queries_min': min(query_counts), 'queries_max': max(query_counts)}
+
+
+def authenticated_client(user):
+    # Real JWT header, so authentication cost is part of every measurement
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    return client
+
+
+def run_endpoints(range_days=7, repeat=5):
+    """Time the main read and write paths against the generated dataset.
+
+    Returns ``{name: {latency percentiles, queries_min, queries_max}}``.
+    """
+    user = get_user_model().objects.filter(username__startswith='bench_user_').order_by('id').first()
+    client = authenticated_client(user)
+    start = START_DATE
+    end = START_DATE + timedelta(days=range_days - 1)
+    recipe = Recipe.objects.with_ingredients().order_by('id').first()
+    recipe_data = {
+        'name': recipe.name, 'instructions': recipe.instructions, 'portions': recipe.portions,
+        'ingredients': [{'ingredient': {'name': ia.ingredient.name}, 'unit': ia.unit, 'amount': ia.amount}
+                        for ia in recipe.ingredientamount_set.all()],
+    }
+    # Writes land on days after the generated range so they never collide with it
+    last_day = Meal.objects.order_by('-date').values_list('date', flat=True).first() or START_DATE
+
+    def check(response, expected_status):
+        if response.status_code != expected_status:
+            raise RuntimeError(f'{response.status_code} from {response.request["PATH_INFO"]}: {response.content[:200]}')
+        return response
+
+    def shopping_list_endpoint(run):
+        cache.clear()
+        check(client.get(f'/api/meals/get_shopping_list/{start}/{end}/'), 200)
+
+    def add_meal(run):
+        meal_data = {'date': str(last_day + timedelta(days=run + 1)), 'meal': 'lu',
+                     'dishes': [{'recipe': recipe_data, 'portions': 2}],
+                     'extras': [{'item': {'name': 'Bench Extra'}, 'unit': 'unt', 'amount': 1}]}
+        check(client.post('/api/meals/add/', meal_data, format='json'), 201)
+
+    def add_recipe(run):
+        check(client.post('/api/recipes/add/', {**recipe_data, 'name': f'Bench Recipe {run}'}, format='json'), 201)
+
+    calls = {
+        'extract_ingredient_list': lambda run: Meal.extract_ingredient_list(start, end),
+        'extract_ingredient_list_user': lambda run: Meal.extract_ingredient_list(start, end, user=user),
+        'get_meals_between_dates': lambda run: check(client.get(f'/api/meals/get_range/{start}/{end}/'), 200),
+        'ingredient_list_uncached': shopping_list_endpoint,
+        'add_meal': add_meal,
+        'add_recipe': add_recipe,
+    }
+    return {name: timed_calls(func, repeat) for name, func in calls.items()}
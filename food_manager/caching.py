@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+# Versioned cache keys for per-user shopping lists.
+#
+# Cached entries are never deleted one by one. Every key embeds the user's current
+# version (plus a global epoch), and invalidating a user just bumps the version so
+# their old entries are never read again and expire on their own. Versions start
+# from the clock, so a version key that got evicted never comes back with a value
+# that older entries were stored under.
+
+EPOCH_KEY = 'shopping_list:epoch'
+
+
+def _version_key(user_id):
+    return f'shopping_list:version:{user_id}'
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def _shopping_list_key(epoch, user_id, version, start_date, end_date, variant):
+    parts = [str(part) for part in (epoch, user_id, version, start_date, end_date, *variant)]
+    return 'shopping_list:' + ':'.join(parts)
+
+
+def shopping_list_key(user_id, start_date, end_date, *variant):
+    epoch = cache.get_or_set(EPOCH_KEY, _new_version, timeout=None)
+    version = cache.get_or_set(_version_key(user_id), _new_version, timeout=None)
+    return _shopping_list_key(epoch, user_id, version, start_date, end_date, variant)
+
+
+def get_shopping_list(key):
+    return cache.get(key)
+
+
+def set_shopping_list(key, value):
+    cache.set(key, value, timeout=settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+# Async variants for the async views, so a network cache backend doesn't block the event loop
+
+
+async def ashopping_list_key(user_id, start_date, end_date, *variant):
+    epoch = await cache.aget_or_set(EPOCH_KEY, _new_version, timeout=None)
+    version = await cache.aget_or_set(_version_key(user_id), _new_version, timeout=None)
+    return _shopping_list_key(epoch, user_id, version, start_date, end_date, variant)
+
+
+async def aget_shopping_list(key):
+    return await cache.aget(key)
+
+
+async def aset_shopping_list(key, value):
+    await cache.aset(key, value, timeout=settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _new_version(), timeout=None)
+
+
+def invalidate_shopping_lists(user_ids):
+    for user_id in user_ids:
+        _bump(_version_key(user_id))
+
+
+def invalidate_all_shopping_lists():
+    _bump(EPOCH_KEY)
+
+
+# Serialized representations keyed by something that changes with their content,
+# such as a recipe's id and version. Entries are never invalidated, a change makes
+# new keys and the old entries fall out of the LRU (or expire in the shared cache).
+# Lookups hit a per-process LRU first, then the cache named by
+# REPRESENTATION_SHARED_CACHE when one is configured, so workers share the work.
+
+
+class RepresentationCache:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _shared(self):
+        alias = settings.REPRESENTATION_SHARED_CACHE
+        return caches[alias] if alias else None
+
+    def get(self, key):
+        """Cached value of ``key`` or None. Treat it as read-only."""
+        value = self._local(key)
+        if value is not None:
+            return value
+        shared = self._shared()
+        value = shared.get(f'{self.prefix}:{key}') if shared is not None else None
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        shared = self._shared()
+        if shared is not None:
+            shared.set(f'{self.prefix}:{key}', value, timeout=settings.REPRESENTATION_CACHE_TIMEOUT)
+        self._remember(key, value)
+
+    def _local(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    async def aget(self, key):
+        """Like get(), for async views: the shared cache is read with the async cache API."""
+        value = self._local(key)
+        if value is not None:
+            return value
+        shared = self._shared()
+        value = await shared.aget(f'{self.prefix}:{key}') if shared is not None else None
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    async def aset(self, key, value):
+        shared = self._shared()
+        if shared is not None:
+            await shared.aset(f'{self.prefix}:{key}', value, timeout=settings.REPRESENTATION_CACHE_TIMEOUT)
+        self._remember(key, value)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.REPRESENTATION_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Cached value of ``key``, computed and stored by ``compute()`` on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+
+recipe_representations = RepresentationCache('recipe')
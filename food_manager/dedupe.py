@@ -0,0 +1,168 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from food_manager import caching, demand, search, stock, units
+from food_manager.models import Ingredient, Recipe, IngredientAmount, ExtraItems, IngredientPack, StockEntry
+
+# Merging of duplicate Ingredient rows.
+#
+# Duplicates are found by normalised name (case and whitespace) and, optionally,
+# by trigram similarity between neighbours in the sorted list of names, which
+# catches plurals and typos without comparing every pair. Each cluster folds into
+# its oldest row. References (recipe lines, extra items, packs) are repointed with
+# one CASE UPDATE per batch of duplicate ids; a recipe that ends up listing the
+# canonical ingredient twice keeps one line with the amounts added up. Stock
+# ledger entries are repointed too and the merged balances rebuilt from them. Demand days
+# touched by the merge are marked and refreshed once the merge commits.
+
+
+def find_clusters(names, threshold=None, window=5):
+    """Group ``(id, name)`` pairs into clusters of duplicates, as sorted id lists.
+
+    With a ``threshold``, names within ``window`` places of each other in sorted
+    order are also merged when they are near-duplicates (search.is_near_duplicate).
+    Clusters of one are left out.
+    """
+    by_key = defaultdict(list)
+    for pk, name in names:
+        by_key[search.normalise(name)].append(pk)
+    keys = sorted(by_key)
+
+    parent = {key: key for key in keys}
+
+    def root(key):
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    if threshold is not None:
+        for position, key in enumerate(keys):
+            for other in keys[position + 1:position + 1 + window]:
+                if search.is_near_duplicate(key, other, threshold):
+                    parent[root(other)] = root(key)
+
+    clusters = defaultdict(list)
+    for key in keys:
+        clusters[root(key)].extend(by_key[key])
+    return [sorted(ids) for ids in clusters.values() if len(ids) > 1]
+
+
+def _batches(items, batch_size):
+    items = list(items)
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def _plan_collisions(mapping, densities, batch_size):
+    """Work out how recipe lines that would collide after the merge are combined.
+
+    Returns ``(keepers, losers, skipped)``: the lines that stay with their summed
+    amount, the line ids to delete, and the duplicate ids that can't be merged
+    because a recipe lists them in units that don't convert into each other.
+    """
+    involved = set(mapping) | set(mapping.values())
+    lines = []
+    for batch in _batches(involved, batch_size):
+        lines.extend(IngredientAmount.objects.filter(ingredient_id__in=batch)
+                     .values_list('id', 'recipe_id', 'ingredient_id', 'unit', 'amount'))
+
+    skipped = set()
+    while True:
+        groups = defaultdict(list)
+        for line in lines:
+            ingredient_id = line[2]
+            if ingredient_id not in skipped:
+                groups[(line[1], mapping.get(ingredient_id, ingredient_id))].append(line)
+
+        keepers, losers, unconvertible = {}, [], set()
+        for (_, canonical), group in groups.items():
+            if len(group) == 1:
+                continue
+            # The canonical ingredient's own line wins, otherwise the oldest one
+            group.sort(key=lambda line: (line[2] != canonical, line[0]))
+            keeper_id, _, _, keeper_unit, _ = group[0]
+            total = 0.0
+            for _, _, ingredient_id, unit, amount in group:
+                converted = units.convert(amount, unit, keeper_unit, densities.get(canonical))
+                if converted is None:
+                    # Never the canonical row, it has at most one line per recipe and that one is the keeper
+                    unconvertible.add(ingredient_id)
+                else:
+                    total += converted
+            keepers[keeper_id] = total
+            losers.extend(line[0] for line in group[1:])
+
+        if not unconvertible:
+            return keepers, losers, skipped
+        # Leave those duplicates alone and plan again without them
+        skipped |= unconvertible
+
+
+def _repoint(model, field, mapping, batch_size):
+    for batch in _batches(mapping, batch_size):
+        model.objects.filter(**{f'{field}__in': batch}).update(
+            **{field: Case(*[When(**{field: dup}, then=Value(mapping[dup])) for dup in batch])}
+        )
+
+
+def merge(clusters, batch_size=500):
+    """Fold every cluster into its lowest id and delete the other rows.
+
+    Returns counts of the merged rows, the summed recipe lines and the duplicates
+    left alone because their recipe lines couldn't be added up.
+    """
+    mapping = {dup: ids[0] for ids in clusters for dup in ids[1:]}
+    if not mapping:
+        return {'merged': 0, 'summed_lines': 0, 'skipped': 0}
+
+    with transaction.atomic():
+        densities = {}
+        for batch in _batches(set(mapping) | set(mapping.values()), batch_size):
+            densities.update(Ingredient.objects.filter(id__in=batch, density__isnull=False)
+                             .values_list('id', 'density'))
+        # A canonical row without a density takes the one of a duplicate
+        filled = {}
+        for dup, canonical in sorted(mapping.items()):
+            if canonical not in densities and dup in densities:
+                filled[canonical] = densities[canonical] = densities[dup]
+
+        keepers, losers, skipped = _plan_collisions(mapping, densities, batch_size)
+        for dup in skipped:
+            del mapping[dup]
+
+        Ingredient.objects.bulk_update([Ingredient(id=pk, density=density) for pk, density in filled.items()],
+                                       ['density'], batch_size=batch_size)
+        for batch in _batches(losers, batch_size):
+            IngredientAmount.objects.filter(id__in=batch).delete()
+        IngredientAmount.objects.bulk_update(
+            [IngredientAmount(id=pk, amount=amount) for pk, amount in keepers.items()], ['amount'], batch_size=batch_size
+        )
+
+        # Queryset updates skip the signals, mark and version what the repointing touches
+        recipe_ids, meal_ids = set(), set()
+        for batch in _batches(mapping, batch_size):
+            recipe_ids.update(IngredientAmount.objects.filter(ingredient_id__in=batch)
+                              .values_list('recipe_id', flat=True))
+            meal_ids.update(ExtraItems.objects.filter(item_id__in=batch).values_list('meal_id', flat=True))
+        _repoint(IngredientAmount, 'ingredient_id', mapping, batch_size)
+        _repoint(ExtraItems, 'item_id', mapping, batch_size)
+        _repoint(IngredientPack, 'ingredient_id', mapping, batch_size)
+        _repoint(StockEntry, 'ingredient_id', mapping, batch_size)
+        for batch in _batches(set(mapping) | set(mapping.values()), batch_size):
+            stock.rebuild_balances(ingredient_ids=batch)
+        caching.invalidate_all_shopping_lists()
+        demand.mark_recipes_dirty(recipe_ids)
+        demand.mark_meals_dirty(meal_ids)
+        for batch in _batches(recipe_ids, batch_size):
+            Recipe.objects.filter(id__in=batch).bump_versions()
+        for batch in _batches(filled, batch_size):
+            Recipe.objects.filter(ingredientamount__ingredient_id__in=batch).bump_versions()
+
+        # Also drops their IngredientDemand rows, recomputed by the refresh once this commits
+        for batch in _batches(mapping, batch_size):
+            Ingredient.objects.filter(id__in=batch).delete()
+
+    return {'merged': len(mapping), 'summed_lines': len(keepers), 'skipped': len(skipped)}
@@ -0,0 +1,107 @@
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+from food_manager import caching, tracing
+from food_manager.aggregation import dish_totals, extra_totals
+from food_manager.models import IngredientDemand, Meal
+
+# Incremental maintenance of the IngredientDemand table.
+#
+# Writes only mark what they touched (user days, meals or recipes). The marks are
+# collected per thread and resolved to (user, date) pairs once the surrounding
+# transaction commits, so a whole serializer save or cascade delete refreshes every
+# affected day exactly once. Model signals (food_manager.signals) cover regular
+# saves and deletes; code paths that bypass signals (bulk_create, queryset update)
+# have to call the mark_* functions themselves.
+#
+# Every refresh also invalidates the cached shopping lists of the users involved.
+
+_pending = threading.local()
+
+
+def _dirty():
+    if not hasattr(_pending, 'days'):
+        _pending.days = set()
+        _pending.meal_ids = set()
+        _pending.recipe_ids = set()
+    return _pending
+
+
+def _schedule(using=None):
+    transaction.on_commit(flush, using=using)
+
+
+def mark_days_dirty(days, using=None):
+    """Mark ``(user_id, date)`` pairs."""
+    _dirty().days.update(days)
+    _schedule(using)
+
+
+def mark_meals_dirty(meal_ids, using=None):
+    _dirty().meal_ids.update(meal_ids)
+    _schedule(using)
+
+
+def mark_recipes_dirty(recipe_ids, using=None):
+    _dirty().recipe_ids.update(recipe_ids)
+    _schedule(using)
+
+
+def flush():
+    """Refresh every day marked since the last flush."""
+    pending = _dirty()
+    if not (pending.days or pending.meal_ids or pending.recipe_ids):
+        return
+
+    days, meal_ids, recipe_ids = pending.days, pending.meal_ids, pending.recipe_ids
+    pending.days, pending.meal_ids, pending.recipe_ids = set(), set(), set()
+
+    if meal_ids:
+        days.update(Meal.objects.filter(id__in=meal_ids).values_list('user_id', 'date'))
+    if recipe_ids:
+        days.update(Meal.objects.filter(dish__recipe_id__in=recipe_ids).values_list('user_id', 'date'))
+    refresh_days(days)
+
+
+def refresh_days(days):
+    """Recompute the demand rows of the ``(user_id, date)`` pairs in ``days``.
+
+    Every marked user is refreshed on every marked date, recomputing a few
+    untouched days is cheaper than matching pairs one by one.
+    """
+    days = set(days)
+    if not days:
+        return
+    user_ids = {user_id for user_id, _ in days}
+    dates = {day for _, day in days}
+
+    meals = Meal.objects.filter(user_id__in=user_ids, date__in=dates)
+    demand = defaultdict(float)
+    with tracing.span('demand.aggregate', users=len(user_ids), dates=len(dates)):
+        for rows in (dish_totals(meals, 'user_id', 'date'), extra_totals(meals, 'user_id', 'date')):
+            for row in rows:
+                key = (row['meal_user_id'], row['meal_date'], row['ingredient_pk'], row['base_unit'])
+                demand[key] += row['total'] or 0.0
+
+    with transaction.atomic(), tracing.span('demand.write', rows=len(demand)):
+        IngredientDemand.objects.filter(user_id__in=user_ids, date__in=dates).delete()
+        IngredientDemand.objects.bulk_create(
+            [IngredientDemand(user_id=user_id, date=day, ingredient_id=ingredient_id, unit=unit, amount=amount)
+             for (user_id, day, ingredient_id, unit), amount in demand.items()],
+            batch_size=500,
+        )
+    caching.invalidate_shopping_lists(user_ids)
+
+
+def rebuild(batch_days=31):
+    """Throw away and recompute the whole table, ``batch_days`` days at a time."""
+    with transaction.atomic():
+        IngredientDemand.objects.all().delete()
+        days = list(Meal.objects.order_by('date').values_list('date', flat=True).distinct())
+        for start in range(0, len(days), batch_days):
+            batch = days[start:start + batch_days]
+            refresh_days(Meal.objects.filter(date__in=batch).values_list('user_id', 'date').distinct())
+    caching.invalidate_all_shopping_lists()
+    return len(days)
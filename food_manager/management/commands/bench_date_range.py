@@ -0,0 +1,53 @@
+import json
+import math
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from food_manager import benchmark
+from food_manager.aggregation import shopping_list
+from food_manager.models import Meal
+
+
+class Command(BaseCommand):
+    help = 'Measure date-range query latency on synthetic meal tables (runs in a throwaway test database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meals', type=int, nargs='+', default=[100_000, 1_000_000],
+                            help='Table sizes to benchmark')
+        parser.add_argument('--days', type=int, default=365, help='Days the meals are spread over')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        for size in options['meals']:
+            meals_per_day = len(Meal.MEAL_CHOICES)
+            users = math.ceil(size / (options['days'] * meals_per_day))
+            with benchmark.throwaway_database():
+                dataset = benchmark.generate(users=users, meals_per_day=meals_per_day, days=options['days'])
+                user_id = Meal.objects.values_list('user_id', flat=True).first()
+                week = (benchmark.START_DATE + timedelta(days=100), benchmark.START_DATE + timedelta(days=106))
+                month = (benchmark.START_DATE + timedelta(days=100), benchmark.START_DATE + timedelta(days=130))
+
+                queries = {
+                    'all_users_week': lambda: list(
+                        Meal.objects.filter(date__range=week).values_list('id', flat=True)),
+                    'one_user_month': lambda: list(
+                        Meal.objects.filter(user_id=user_id, date__range=month).values_list('id', flat=True)),
+                    'shopping_list_one_user_month': lambda: shopping_list(
+                        Meal.objects.filter(user_id=user_id, date__range=month)),
+                    'shopping_list_all_users_day': lambda: shopping_list(
+                        Meal.objects.filter(date__range=(week[0], week[0]))),
+                }
+                timings = {name: benchmark.summarise(benchmark.measure(query, options['repeat']))
+                           for name, query in queries.items()}
+            results.append({'dataset': dataset, 'timings': timings})
+
+            if not options['json']:
+                self.stdout.write(f"{dataset['meals']} meals ({users} users x {options['days']} days)")
+                for name, timing in timings.items():
+                    self.stdout.write(f"  {name:<32} p50 {timing['p50_ms']:>10.3f} ms   max {timing['max_ms']:>10.3f} ms")
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,57 @@
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand
+
+from food_manager import benchmark, demand
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the shopping list, meal range and write endpoints on a synthetic dataset '
+            '(runs in a throwaway test database) and print the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--recipes', type=int, default=50)
+        parser.add_argument('--ingredients', type=int, default=8, help='Ingredients per recipe')
+        parser.add_argument('--meals-per-day', type=int, default=3)
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--dishes-per-meal', type=int, default=2)
+        parser.add_argument('--range-days', type=int, default=7, help='Width of the queried date ranges')
+        parser.add_argument('--repeat', type=int, default=10, help='Runs per measurement')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        with benchmark.throwaway_database():
+            dataset = benchmark.generate(
+                users=options['users'], recipes=options['recipes'], ingredients_per_recipe=options['ingredients'],
+                meals_per_day=options['meals_per_day'], days=options['days'],
+                dishes_per_meal=options['dishes_per_meal'],
+            )
+            rebuild = benchmark.timed_calls(lambda run: demand.rebuild(), repeat=1)
+            results = benchmark.run_endpoints(range_days=options['range_days'], repeat=options['repeat'])
+
+        report = {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'dataset': dataset,
+            'range_days': options['range_days'],
+            'results': {'rebuild_ingredient_demand': rebuild, **results},
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from food_manager import dedupe
+from food_manager.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Merge duplicate ingredients into their oldest row and repoint recipes and extra items to it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exact', action='store_true',
+                            help='Only merge names that are equal up to case and whitespace')
+        parser.add_argument('--threshold', type=float, default=settings.NAME_SIMILARITY_THRESHOLD,
+                            help='Trigram similarity from which two names count as duplicates')
+        parser.add_argument('--window', type=int, default=5,
+                            help='Number of following names (in sorted order) each name is compared with')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of ingredient ids per bulk UPDATE or DELETE')
+        parser.add_argument('--dry-run', action='store_true', help='List the clusters without merging them')
+
+    def handle(self, *args, **options):
+        names = Ingredient.objects.values_list('id', 'name').iterator(chunk_size=10000)
+        clusters = dedupe.find_clusters(names, threshold=None if options['exact'] else options['threshold'],
+                                        window=options['window'])
+        self.stdout.write(f'Found {len(clusters)} clusters with {sum(map(len, clusters)) - len(clusters)} duplicates')
+
+        if options['dry_run']:
+            names = dict(Ingredient.objects.filter(id__in=[pk for ids in clusters for pk in ids])
+                         .values_list('id', 'name'))
+            for ids in clusters:
+                self.stdout.write(f'{names[ids[0]]!r} <- ' + ', '.join(repr(names[pk]) for pk in ids[1:]))
+            return
+
+        result = dedupe.merge(clusters, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Merged {result['merged']} ingredients, summed {result['summed_lines']} recipe lines, "
+            f"skipped {result['skipped']} with unconvertible units"
+        ))
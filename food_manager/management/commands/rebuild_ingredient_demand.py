@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from food_manager import demand
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-day ingredient demand table from all planned meals'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-days', type=int, default=31,
+                            help='Number of days recomputed per query batch')
+
+    def handle(self, *args, **options):
+        days = demand.rebuild(batch_days=options['batch_days'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt ingredient demand for {days} days'))
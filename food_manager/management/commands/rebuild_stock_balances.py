@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from food_manager import stock
+from food_manager.models import StockBalance
+
+
+class Command(BaseCommand):
+    help = 'Recompute the running stock balances from the stock ledger'
+
+    def handle(self, *args, **options):
+        stock.rebuild_balances()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {StockBalance.objects.count()} stock balances'))
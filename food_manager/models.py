@@ -1,24 +1,63 @@
+import time
+
 from django.db import models
+from django.db.models.functions import Lower
 from django.conf import settings
 from datetime import date
 from django.utils import timezone
-from collections import defaultdict
+from food_manager import units
 
 
 # Create your models here.
 
 class Ingredient(models.Model):
-    name = models.CharField(max_length=100, blank=False, null=False)
+    name = models.CharField(max_length=100, blank=False, null=False, db_index=True)
+    density = models.FloatField(blank=True, null=True,
+                                help_text='Grams per milliliter, used to merge volume and mass shopping list totals')
+    # Nutrients per 100 g, volumes count through the density (food_manager.nutrition)
+    energy_kcal = models.FloatField(blank=True, null=True)
+    protein = models.FloatField(blank=True, null=True, help_text='Grams')
+    fat = models.FloatField(blank=True, null=True, help_text='Grams')
+    carbohydrates = models.FloatField(blank=True, null=True, help_text='Grams')
 
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            # Case-insensitive lookups; not unique yet, existing data has "Olive oil"/"olive Oil" duplicates
+            models.Index(Lower('name'), name='ingredient_name_lower_idx'),
+        ]
+
+
+def new_recipe_version():
+    # Clock based, so a version is never handed out twice, even after the row was deleted
+    return time.time_ns()
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_ingredients(self):
+        # Everything RecipeSerializer reads, in two queries however many recipes are loaded
+        return self.prefetch_related(
+            models.Prefetch('ingredientamount_set', queryset=IngredientAmount.objects.select_related('ingredient'))
+        )
+
+    def bump_versions(self):
+        """Give every recipe in the queryset a new version, returns it."""
+        version = new_recipe_version()
+        self.update(version=version)
+        return version
+
 
 class Recipe(models.Model):
-    name = models.CharField(max_length=100, blank=False, null=False)
+    name = models.CharField(max_length=100, blank=False, null=False, db_index=True)
     instructions = models.TextField(help_text='Please give instructions on the recipe')
     ingredients = models.ManyToManyField(Ingredient, through='IngredientAmount')
     portions = models.IntegerField()
+    # Changes whenever the recipe or its ingredient lines change, keys the representation cache
+    version = models.BigIntegerField(default=new_recipe_version, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -28,18 +67,7 @@ class Recipe(models.Model):
 class IngredientAmount(models.Model):
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    UNITS_CHOICES = [
-        ('gr', 'grams'),
-        ('kg', 'kilograms'),
-        ('ml', 'milliliters'),
-        ('lt', 'liters'),
-        ('unt', 'units'),
-        ('cl', 'cloves'),
-        ('tsp', 'teaspoon'),
-        ('cp', 'cup'),
-        ('tbl', 'tablespoon')
-        # TODO add spoons, cups etc
-    ]
+    UNITS_CHOICES = units.UNITS_CHOICES
     unit = models.CharField(max_length=3, choices=UNITS_CHOICES)
     amount = models.FloatField(blank=False, null=False)
 
@@ -47,6 +75,26 @@ class IngredientAmount(models.Model):
         unique_together = ('ingredient', 'recipe')
 
 
+class MealQuerySet(models.QuerySet):
+    def with_contents(self):
+        # Everything MealSerializer reads, in a fixed number of queries however many meals are loaded
+        dishes = Dish.objects.select_related('recipe').prefetch_related(
+            models.Prefetch('recipe__ingredientamount_set',
+                            queryset=IngredientAmount.objects.select_related('ingredient'))
+        )
+        return self.prefetch_related(
+            models.Prefetch('dish_set', queryset=dishes),
+            models.Prefetch('extraitems_set', queryset=ExtraItems.objects.select_related('item')),
+        )
+
+    def in_day_order(self):
+        # By date, then breakfast, lunch, dinner and snack as listed in MEAL_CHOICES
+        position = models.Case(*[models.When(meal=code, then=models.Value(index))
+                                 for index, (code, _) in enumerate(Meal.MEAL_CHOICES)],
+                               output_field=models.IntegerField())
+        return self.order_by('date', position)
+
+
 # model used for storing breakfast,lunch or dinner
 class Meal(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -62,40 +110,21 @@ class Meal(models.Model):
     recipes = models.ManyToManyField(Recipe, through='Dish')
     extra = models.ManyToManyField(Ingredient, through='ExtraItems')
 
+    objects = MealQuerySet.as_manager()
+
     class Meta:
         unique_together = ['user', 'date', 'meal']
+        indexes = [
+            # Date range scans across all users (shopping lists, demand refreshes)
+            models.Index(fields=['date'], name='meal_date_idx'),
+        ]
 
     @staticmethod
-    def extract_ingredient_list(start_date, end_date):
-        meals = Meal.objects.filter(date__range=(start_date, end_date))
-        ingredient_list = defaultdict(float)
-
-        # Define unit conversions
-        unit_conversions = {'kg': 1000, 'gr': 1, 'lt': 1000, 'cp': 240, 'tablespoon': 15, 'teaspoon': 5, 'ml': 1}
-
-        for meal in meals:
-            for dish in meal.dish_set.all():
-                recipe = dish.recipe
-                portions = dish.portions
-
-                for ingredient_amount in recipe.ingredientamount_set.all():
-                    ingredient = ingredient_amount.ingredient
-                    amount = ingredient_amount.amount / recipe.portions * portions
-
-                    # Convert to a common unit (ml or g)
-                    if ingredient_amount.unit in unit_conversions:
-                        amount *= unit_conversions[ingredient_amount.unit]
-                        unit = 'ml' if ingredient_amount.unit in ['lt', 'cp', 'tbl', 'tsp'] else 'gr'
-                    else:
-                        unit = ingredient_amount.unit
+    def extract_ingredient_list(start_date, end_date, merge=False, user=None):
+        from food_manager.aggregation import as_ingredient_list, demand_totals
 
-                    # Convert the tuple key to a string
-                    ingredient_key = f"{ingredient.name}, {unit}"
-
-                    # Add to the total ingredient list
-                    ingredient_list[ingredient_key] += amount
-
-        return dict(ingredient_list)
+        # Served from the per-day demand table, see food_manager.demand
+        return as_ingredient_list(demand_totals(start_date, end_date, user=user), merge=merge)
 
 
 class Dish(models.Model):
@@ -103,21 +132,73 @@ class Dish(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     portions = models.IntegerField(blank=False, null=False, default=1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['meal', 'recipe'], name='dish_meal_recipe_idx'),
+        ]
+
 
 class ExtraItems(models.Model):
     meal = models.ForeignKey(Meal, on_delete=models.CASCADE)
     item = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
-    UNITS_CHOICES = [
-        ('gr', 'grams'),
-        ('kg', 'kilograms'),
-        ('ml', 'milliliters'),
-        ('lt', 'liters'),
-        ('unt', 'units'),
-        ('cl', 'cloves'),
-        ('tsp', 'teaspoon'),
-        ('cp', 'cup'),
-        ('tbl', 'tablespoon')
-        # TODO add spoons, cups etc
-    ]
+    UNITS_CHOICES = units.UNITS_CHOICES
     unit = models.CharField(max_length=3, choices=UNITS_CHOICES)
     amount = models.FloatField(blank=False, null=False)
+
+
+# A pack size an ingredient is sold in, used to price shopping lists (food_manager.packs)
+class IngredientPack(models.Model):
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    size = models.FloatField()
+    UNITS_CHOICES = units.UNITS_CHOICES
+    unit = models.CharField(max_length=3, choices=UNITS_CHOICES)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f'{self.ingredient} {self.size:g} {self.unit}'
+
+
+# Pantry ledger: every stock movement of a user, amounts in the normalised unit
+class StockEntry(models.Model):
+    DIRECTION_CHOICES = [
+        ('in', 'In'),
+        ('out', 'Out'),
+    ]
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    unit = models.CharField(max_length=3)  # normalised unit
+    quantity = models.FloatField()
+    direction = models.CharField(max_length=3, choices=DIRECTION_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='stockentry_user_created_idx'),
+        ]
+
+
+# Running stock per user, ingredient and normalised unit, maintained by food_manager.stock
+class StockBalance(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    unit = models.CharField(max_length=3)  # normalised unit
+    amount = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'ingredient', 'unit')
+
+
+# Precomputed ingredient demand per user and day, maintained by food_manager.demand
+class IngredientDemand(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    date = models.DateField()
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    unit = models.CharField(max_length=3)  # normalised unit
+    amount = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'date', 'ingredient', 'unit')
+        indexes = [
+            # Range-sums over every user's demand
+            models.Index(fields=['date'], name='ingredientdemand_date_idx'),
+        ]
@@ -0,0 +1,83 @@
+from array import array
+
+from food_manager import units
+from food_manager.models import Ingredient, IngredientAmount, ExtraItems
+
+# Nutrition of planned meals.
+#
+# Ingredients carry their nutrients per 100 g. Volumes are converted to grams with
+# the ingredient's density, like the merged shopping list; without a density they
+# are counted per 100 ml instead. Every ingredient line of the meals, recipe lines
+# scaled like the shopping list (amount / recipe.portions * dish.portions) and
+# extra items as they are, is read once as plain tuples into flat arrays: the meal
+# it belongs to, the ingredient's column, the amount in base units and whether
+# that is a volume. One loop over those lines then adds up every nutrient, with no
+# ORM objects built along the way.
+
+NUTRIENTS = ('energy_kcal', 'protein', 'fat', 'carbohydrates')
+
+_MEASURED = ('mass', 'volume')
+
+
+def _lines(meals, chunk_size):
+    dish_lines = (IngredientAmount.objects.filter(recipe__dish__meal__in=meals)
+                  .values_list('recipe__dish__meal_id', 'ingredient_id', 'unit', 'amount',
+                               'recipe__portions', 'recipe__dish__portions')
+                  .iterator(chunk_size=chunk_size))
+    for meal_id, ingredient_id, unit, amount, recipe_portions, dish_portions in dish_lines:
+        # Like the database division in dish_totals, a recipe without portions adds nothing
+        if recipe_portions:
+            yield meal_id, ingredient_id, unit, amount / recipe_portions * dish_portions
+
+    extra_lines = (ExtraItems.objects.filter(meal__in=meals)
+                   .values_list('meal_id', 'item_id', 'unit', 'amount')
+                   .iterator(chunk_size=chunk_size))
+    yield from extra_lines
+
+
+def rollup(meals, chunk_size=2000):
+    """Nutrient totals of every meal in ``meals`` that has ingredients.
+
+    Returns ``(totals, incomplete)``: ``{meal_id: {nutrient: value}}`` and the
+    names of the ingredients that were left out or only partly counted, because
+    they lack nutrients or are measured in units without a mass or volume.
+    """
+    positions, columns = {}, {}
+    position, column, amounts, is_volume = array('l'), array('l'), array('d'), array('b')
+    uncounted = set()
+    for meal_id, ingredient_id, unit, amount in _lines(meals, chunk_size):
+        unit = units.UNITS.get(unit)
+        if unit is None or unit.dimension not in _MEASURED:
+            uncounted.add(ingredient_id)
+            continue
+        position.append(positions.setdefault(meal_id, len(positions)))
+        column.append(columns.setdefault(ingredient_id, len(columns)))
+        amounts.append(amount * unit.factor)
+        is_volume.append(unit.dimension == 'volume')
+
+    # Nutrients per 100 g, one row of len(NUTRIENTS) values per column
+    width = len(NUTRIENTS)
+    per_hundred = array('d', bytes(8 * width * len(columns)))
+    densities = [None] * len(columns)
+    incomplete = set()
+    rows = (Ingredient.objects.filter(id__in=columns.keys() | uncounted)
+            .values_list('id', 'name', 'density', *NUTRIENTS))
+    for ingredient_id, name, density, *values in rows:
+        if ingredient_id in uncounted or None in values:
+            incomplete.add(name)
+        if ingredient_id in columns:
+            offset = columns[ingredient_id] * width
+            per_hundred[offset:offset + width] = array('d', [value or 0.0 for value in values])
+            densities[columns[ingredient_id]] = density
+
+    volume, mass = units.BASE_UNITS['volume'], units.BASE_UNITS['mass']
+    summed = array('d', bytes(8 * width * len(positions)))
+    for meal, ingredient, amount, volume_line in zip(position, column, amounts, is_volume):
+        _, grams = units.to_mass(volume if volume_line else mass, amount, densities[ingredient])
+        source, target = ingredient * width, meal * width
+        for index in range(width):
+            summed[target + index] += per_hundred[source + index] * grams / 100
+
+    return ({meal_id: dict(zip(NUTRIENTS, summed[index * width:(index + 1) * width]))
+             for meal_id, index in positions.items()},
+            sorted(incomplete))
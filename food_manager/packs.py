@@ -0,0 +1,133 @@
+import math
+from collections import defaultdict
+
+from django.conf import settings
+
+from food_manager import units
+from food_manager.models import IngredientPack
+
+# Cheapest way to buy a shopping list in the pack sizes suppliers sell.
+#
+# Per ingredient this is an unbounded covering knapsack: buy whole packs whose
+# sizes add up to at least the demand, at minimal total price. Baskets are mostly
+# the best value pack, so it is solved by branch and bound over the counts of the
+# few other packs, topping up with best value packs. Each other pack costs a premium
+# over the same amount in best value packs, and a branch is cut as soon as its
+# premiums can't beat the best basket found so far, which keeps the search to a
+# handful of nodes for ordinary catalogues. Counts are also capped by an exchange
+# argument: best_size / gcd(size, best_size) packs of one size could be swapped for
+# whole best value packs at no extra cost. With near-identical prices per unit the
+# search may hit PACK_PLAN_MAX_NODES; the best basket found by then is returned, it
+# always covers the demand.
+
+# Largest power of ten fractional pack sizes are scaled by
+MAX_SCALE = 10 ** 6
+
+
+def _scale(sizes):
+    # Smallest power of ten that makes every size whole
+    scale = 1
+    while scale < MAX_SCALE and any(abs(size * scale - round(size * scale)) > 1e-6 for size in sizes):
+        scale *= 10
+    return scale
+
+
+def cheapest_packs(demand, packs, max_nodes=None):
+    """Cheapest basket of ``packs`` covering ``demand``.
+
+    ``packs`` are ``(size, price)`` pairs in the unit of ``demand``. Returns
+    ``(counts, cost)`` with one count per pack.
+    """
+    if max_nodes is None:
+        max_nodes = settings.PACK_PLAN_MAX_NODES
+    if demand <= 0 or not packs:
+        return [0] * len(packs), 0.0
+
+    best = min(range(len(packs)), key=lambda index: (packs[index][1] / packs[index][0], -packs[index][0]))
+    best_size, best_price = packs[best]
+    per_unit = best_price / best_size
+
+    def top_up(remaining):
+        return max(math.ceil(remaining / best_size - 1e-9), 0)
+
+    # Cheapest first, those are the packs most likely to be worth buying
+    others = sorted((index for index in range(len(packs)) if index != best),
+                    key=lambda index: packs[index][1] / packs[index][0])
+    scale = _scale([size for size, _ in packs])
+    whole_best = round(best_size * scale)
+    limits = {index: math.ceil(demand / packs[index][0] - 1e-9) for index in others}
+    for index in others:
+        whole = round(packs[index][0] * scale)
+        if whole and whole_best:
+            limits[index] = min(limits[index], whole_best // math.gcd(whole, whole_best) - 1)
+
+    # Start from best value packs only
+    counts = [0] * len(packs)
+    best_counts = [0] * len(packs)
+    best_counts[best] = top_up(demand)
+    best_cost = best_counts[best] * best_price
+    nodes = 0
+
+    def search(position, remaining, cost):
+        nonlocal best_counts, best_cost, nodes
+        nodes += 1
+        if position == len(others) or remaining <= 1e-9:
+            count = top_up(remaining)
+            if cost + count * best_price < best_cost - 1e-9:
+                best_cost = cost + count * best_price
+                best_counts = [*counts[:best], count, *counts[best + 1:]]
+            return
+
+        index = others[position]
+        size, price = packs[index]
+        for count in range(limits[index] + 1):
+            left = remaining - count * size
+            # Never below what the rest costs in best value packs, and only grows with count
+            if cost + count * price + max(left, 0) * per_unit >= best_cost - 1e-9 or nodes >= max_nodes:
+                break
+            counts[index] = count
+            search(position + 1, left, cost + count * price)
+            if left <= 1e-9:
+                break
+        counts[index] = 0
+
+    search(0, demand, 0.0)
+    return best_counts, best_cost
+
+
+def pack_plan(rows):
+    """Cheapest packs for demand total rows (see aggregation.demand_totals).
+
+    Volumes are merged into mass where the density is known, like the merged
+    shopping list. Returns ``(plan, unpriced)``: ``{"<ingredient>, <unit>": {...}}``
+    for everything that has packs in a matching unit, and the keys that don't.
+    """
+    totals, densities = defaultdict(float), {}
+    for row in rows:
+        unit, amount = units.to_mass(row['base_unit'], row['total'] or 0.0, row['density'])
+        totals[(row['ingredient_pk'], row['name'], unit)] += amount
+        densities[row['ingredient_pk']] = row['density']
+
+    packs_by_ingredient = defaultdict(list)
+    for pack in IngredientPack.objects.filter(ingredient_id__in=densities):
+        packs_by_ingredient[pack.ingredient_id].append(pack)
+
+    plan, unpriced = {}, []
+    for (ingredient_pk, name, unit), amount in totals.items():
+        key = f'{name}, {unit}'
+        usable = [(pack, units.convert(pack.size, pack.unit, unit, densities[ingredient_pk]))
+                  for pack in packs_by_ingredient[ingredient_pk]]
+        usable = [(pack, size) for pack, size in usable if size]
+        if not usable:
+            unpriced.append(key)
+            continue
+
+        counts, cost = cheapest_packs(amount, [(size, float(pack.price)) for pack, size in usable])
+        plan[key] = {
+            'amount': amount,
+            'packs': [{'id': pack.pk, 'size': pack.size, 'unit': pack.unit, 'price': float(pack.price),
+                       'count': count}
+                      for (pack, _), count in zip(usable, counts) if count],
+            'cost': round(cost, 2),
+        }
+    return plan, unpriced
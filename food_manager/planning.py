@@ -0,0 +1,128 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import DateField, ExpressionWrapper, F, Value
+from django.db.models.functions import Concat, Substr
+
+from food_manager import demand
+from food_manager.models import Meal, Dish, ExtraItems
+
+# Set-based operations on whole ranges of a user's meal plan. They read and write
+# rows in bulk instead of going through MealSerializer one meal at a time, and
+# mark the demand table themselves since bulk writes skip model signals.
+
+# Prefix of meal codes that are being moved by shift_meals, never a real meal code
+PARKED = '~'
+
+
+class MealConflictError(ValueError):
+    """Raised when an operation would put two meals in the same (user, date, meal) slot."""
+
+    def __init__(self, conflicts):
+        self.conflicts = sorted(conflicts)
+        super().__init__('Meals already planned for: ' + ', '.join(f'{day} {meal}' for day, meal in self.conflicts))
+
+
+def clone_meals(user, source_start, source_end, target_start, repeat=1, batch_size=1000):
+    """Copy the user's meals of ``source_start..source_end`` to ``target_start``, ``repeat`` times.
+
+    Copy ``n`` starts ``n`` range-lengths after ``target_start``. Dishes and extra
+    items come along. Nothing is written if any target slot is already taken.
+    Returns the number of meals, dishes and extras created.
+    """
+    span = (source_end - source_start).days + 1
+    offsets = [(target_start - source_start).days + copy * span for copy in range(repeat)]
+
+    try:
+        with transaction.atomic():
+            source_meals = list(Meal.objects.filter(user=user, date__range=(source_start, source_end))
+                                .values_list('id', 'date', 'meal'))
+            if not source_meals:
+                return {'meals': 0, 'dishes': 0, 'extras': 0}
+
+            planned = {(day + timedelta(days=offset), meal): (meal_id, offset)
+                       for offset in offsets for meal_id, day, meal in source_meals}
+            target_days = [day for day, _ in planned]
+            taken = set(Meal.objects.filter(user=user, date__range=(min(target_days), max(target_days)))
+                        .values_list('date', 'meal'))
+            conflicts = taken & planned.keys()
+            if conflicts:
+                raise MealConflictError(conflicts)
+
+            # New meal id for every (source meal, offset) pair
+            created = Meal.objects.bulk_create(
+                [Meal(user=user, date=day, meal=meal) for day, meal in planned], batch_size=batch_size
+            )
+            new_ids = {planned[(meal.date, meal.meal)]: meal.pk for meal in created}
+            source_ids = [meal_id for meal_id, _, _ in source_meals]
+
+            dishes = [Dish(meal_id=new_ids[(meal_id, offset)], recipe_id=recipe_id, portions=portions)
+                      for meal_id, recipe_id, portions in Dish.objects.filter(meal_id__in=source_ids)
+                      .values_list('meal_id', 'recipe_id', 'portions')
+                      for offset in offsets]
+            Dish.objects.bulk_create(dishes, batch_size=batch_size)
+
+            extras = [ExtraItems(meal_id=new_ids[(meal_id, offset)], item_id=item_id, unit=unit, amount=amount)
+                      for meal_id, item_id, unit, amount in ExtraItems.objects.filter(meal_id__in=source_ids)
+                      .values_list('meal_id', 'item_id', 'unit', 'amount')
+                      for offset in offsets]
+            ExtraItems.objects.bulk_create(extras, batch_size=batch_size)
+
+            demand.mark_days_dirty({(user.pk, day) for day in target_days})
+    except IntegrityError:
+        # A meal was planned in a target slot after the check, find it now that the copy is rolled back
+        taken = set(Meal.objects.filter(user=user, date__range=(min(target_days), max(target_days)))
+                    .values_list('date', 'meal'))
+        raise MealConflictError(taken & planned.keys())
+
+    return {'meals': len(created), 'dishes': len(dishes), 'extras': len(extras)}
+
+
+def delete_meals(user, start_date, end_date, batch_size=1000):
+    """Delete the user's meals of ``start_date..end_date`` with their dishes and extra items.
+
+    Meals go in batches of ``batch_size`` ids, so the cascade collector only ever
+    holds one batch of dishes and extras. Returns the number of meals deleted.
+    """
+    meals = Meal.objects.filter(user=user, date__range=(start_date, end_date))
+    with transaction.atomic():
+        rows = list(meals.values_list('id', 'date'))
+        for start in range(0, len(rows), batch_size):
+            Meal.objects.filter(id__in=[meal_id for meal_id, _ in rows[start:start + batch_size]]).delete()
+        demand.mark_days_dirty({(user.pk, day) for _, day in rows})
+    return len(rows)
+
+
+def shift_meals(user, start_date, end_date, days):
+    """Move the user's meals of ``start_date..end_date`` by ``days`` days, dishes and extras included.
+
+    Raises MealConflictError, without moving anything, when a meal would land on
+    a slot taken by a meal outside the range. Returns the number of meals moved.
+    """
+    meals = Meal.objects.filter(user=user, date__range=(start_date, end_date))
+    shift = timedelta(days=days)
+    with transaction.atomic():
+        source = set(meals.values_list('date', 'meal'))
+        if not source or not days:
+            return 0
+
+        target_start, target_end = start_date + shift, end_date + shift
+        taken = set(Meal.objects.filter(user=user, date__range=(target_start, target_end))
+                    .exclude(date__range=(start_date, end_date)).values_list('date', 'meal'))
+        conflicts = taken & {(day + shift, meal) for day, meal in source}
+        if conflicts:
+            raise MealConflictError(conflicts)
+
+        # The unique (user, date, meal) constraint is checked row by row during an
+        # UPDATE, so shifting onto overlapping days would collide with rows not yet
+        # moved. Park the moved rows under a marked meal code first, then restore it.
+        moved = meals.update(
+            date=ExpressionWrapper(F('date') + shift, output_field=DateField()),
+            meal=Concat(Value(PARKED), F('meal')),
+        )
+        Meal.objects.filter(user=user, date__range=(target_start, target_end), meal__startswith=PARKED) \
+            .update(meal=Substr('meal', len(PARKED) + 1))
+
+        demand.mark_days_dirty({(user.pk, day) for day, _ in source} |
+                               {(user.pk, day + shift) for day, _ in source})
+    return moved
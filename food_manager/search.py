@@ -0,0 +1,173 @@
+import bisect
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import lru_cache
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+
+from food_manager.models import Ingredient, Recipe
+
+# In-process name search over Ingredient and Recipe, for autocomplete and for
+# spotting near-duplicate names.
+#
+# Each index keeps the normalised names sorted (prefix lookups by bisection) and a
+# posting list per trigram (fuzzy lookups scored by trigram similarity, like
+# pg_trgm). It is loaded lazily with one query and kept in sync by model signals
+# and explicit calls from bulk writes, both applied once the transaction commits.
+# Writes made by other processes show up after the periodic rebuild
+# (SEARCH_INDEX_TTL), so callers that act on a match should confirm it against
+# the database.
+
+
+def normalise(name):
+    return ' '.join(name.casefold().split())
+
+
+@lru_cache(maxsize=65536)
+def trigrams(name):
+    """Trigrams of every word, padded like pg_trgm: two spaces in front, one behind."""
+    grams = set()
+    for word in normalise(name).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(first, second):
+    first, second = trigrams(first), trigrams(second)
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def is_near_duplicate(first, second, threshold=None):
+    """Whether two names most likely mean the same thing.
+
+    Names that differ in a number ("Tray 1", "Tray 2") are never duplicates.
+    """
+    if threshold is None:
+        threshold = settings.NAME_SIMILARITY_THRESHOLD
+    if _numbers(first) != _numbers(second):
+        return False
+    return normalise(first) == normalise(second) or similarity(first, second) >= threshold
+
+
+def _numbers(name):
+    return [word for word in normalise(name).split() if any(char.isdigit() for char in word)]
+
+
+class NameIndex:
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._names = {}
+        self._gram_counts = {}
+        self._sorted = []
+        self._postings = defaultdict(set)
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self._names, self._gram_counts, self._sorted, self._postings = {}, {}, [], defaultdict(set)
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < settings.SEARCH_INDEX_TTL:
+            return
+        rows = list(self.model.objects.values_list('id', 'name'))
+        with self._lock:
+            self._names, self._gram_counts, self._sorted, self._postings = {}, {}, [], defaultdict(set)
+            for pk, name in rows:
+                self._add(pk, name)
+            self._sorted.sort()
+            self._loaded_at = time.monotonic()
+
+    def _add(self, pk, name):
+        # Caller holds the lock and keeps _sorted ordered
+        self._names[pk] = name
+        self._sorted.append((normalise(name), pk))
+        grams = trigrams(name)
+        self._gram_counts[pk] = len(grams)
+        for gram in grams:
+            self._postings[gram].add(pk)
+
+    def _remove(self, pk):
+        name = self._names.pop(pk, None)
+        if name is None:
+            return
+        del self._gram_counts[pk]
+        entry = (normalise(name), pk)
+        position = bisect.bisect_left(self._sorted, entry)
+        if position < len(self._sorted) and self._sorted[position] == entry:
+            del self._sorted[position]
+        for gram in trigrams(name):
+            self._postings[gram].discard(pk)
+
+    def _apply(self, rows, removed):
+        if self._loaded_at is None:
+            return  # Whatever was written is picked up by the first load
+        with self._lock:
+            # All removals first, they bisect and need _sorted to still be ordered
+            for pk in [*removed, *(pk for pk, _ in rows)]:
+                self._remove(pk)
+            for pk, name in rows:
+                self._add(pk, name)
+            self._sorted.sort()
+
+    def update(self, instances):
+        """Index ``instances`` (new or renamed) once the current transaction commits."""
+        rows = [(instance.pk, instance.name) for instance in instances]
+        transaction.on_commit(lambda: self._apply(rows, ()))
+
+    def remove(self, pks):
+        pks = list(pks)
+        transaction.on_commit(lambda: self._apply((), pks))
+
+    def search(self, query, limit=10, threshold=None):
+        """Best matches for ``query`` as ``(pk, name, score)``, prefix matches first."""
+        if threshold is None:
+            threshold = settings.SEARCH_MIN_SIMILARITY
+        normalised = normalise(query)
+        if not normalised:
+            return []
+        self._ensure_loaded()
+
+        with self._lock:
+            scores = {}
+            position = bisect.bisect_left(self._sorted, (normalised,))
+            while position < len(self._sorted) and self._sorted[position][0].startswith(normalised):
+                scores[self._sorted[position][1]] = 1.0
+                if len(scores) >= limit:
+                    break
+                position += 1
+
+            query_grams = trigrams(query)
+            shared = Counter(chain.from_iterable(self._postings.get(gram, ()) for gram in query_grams))
+            for pk, count in shared.items():
+                if pk in scores:
+                    continue
+                score = count / (len(query_grams) + self._gram_counts[pk] - count)
+                if score >= threshold:
+                    scores[pk] = score
+            names = {pk: self._names[pk] for pk in scores}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], names[item[0]]))
+        return [(pk, names[pk], round(score, 3)) for pk, score in ranked[:limit]]
+
+    def similar(self, name, threshold=None):
+        """Indexed rows whose name is a near-duplicate of ``name``, as ``(pk, name, score)``."""
+        if threshold is None:
+            threshold = settings.NAME_SIMILARITY_THRESHOLD
+        # Prefix matches score 1.0 in search(), so every candidate is checked again
+        return [(pk, other, round(similarity(name, other), 3))
+                for pk, other, _ in self.search(name, threshold=threshold)
+                if is_near_duplicate(name, other, threshold)]
+
+
+ingredients = NameIndex(Ingredient)
+recipes = NameIndex(Recipe)
@@ -0,0 +1,141 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from food_manager import caching, demand, search
+from food_manager.models import (Ingredient, Recipe, IngredientAmount, Meal, Dish, ExtraItems, IngredientPack,
+                                 new_recipe_version)
+
+
+# Keep the IngredientDemand table in sync with regular model saves and deletes
+
+
+def _remember_previous(instance, *fields):
+    # Stored values of `fields` for rows that are being updated, read back in post_save.
+    # Marking has to wait for post_save: outside atomic() on_commit runs right away,
+    # before the UPDATE is written.
+    previous = None
+    if not instance._state.adding and instance.pk is not None:
+        previous = type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+    instance._demand_previous = previous
+
+
+def _previous(instance):
+    previous = getattr(instance, '_demand_previous', None)
+    instance._demand_previous = None
+    return previous
+
+
+@receiver(pre_save, sender=Meal)
+def meal_moving(sender, instance, **kwargs):
+    _remember_previous(instance, 'user_id', 'date')
+
+
+@receiver(post_save, sender=Meal)
+def meal_moved(sender, instance, **kwargs):
+    previous = _previous(instance)
+    if previous is not None and (previous['user_id'], previous['date']) != (instance.user_id, instance.date):
+        demand.mark_days_dirty([(previous['user_id'], previous['date']), (instance.user_id, instance.date)])
+
+
+@receiver(post_delete, sender=Meal)
+def meal_deleted(sender, instance, **kwargs):
+    demand.mark_days_dirty([(instance.user_id, instance.date)])
+
+
+@receiver(pre_save, sender=Dish)
+@receiver(pre_save, sender=ExtraItems)
+def meal_item_moving(sender, instance, **kwargs):
+    _remember_previous(instance, 'meal_id')
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+@receiver(post_save, sender=ExtraItems)
+@receiver(post_delete, sender=ExtraItems)
+def meal_item_changed(sender, instance, **kwargs):
+    meal_ids = {instance.meal_id}
+    previous = _previous(instance)
+    if previous is not None:
+        meal_ids.add(previous['meal_id'])
+    demand.mark_meals_dirty(meal_ids)
+
+
+@receiver(pre_save, sender=IngredientAmount)
+def ingredient_amount_moving(sender, instance, **kwargs):
+    _remember_previous(instance, 'recipe_id')
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def ingredient_amount_changed(sender, instance, **kwargs):
+    recipe_ids = {instance.recipe_id}
+    previous = _previous(instance)
+    if previous is not None and previous['recipe_id'] != instance.recipe_id:
+        recipe_ids.add(previous['recipe_id'])
+        Recipe.objects.filter(pk=previous['recipe_id']).bump_versions()
+    demand.mark_recipes_dirty(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, created, **kwargs):
+    # Portions scale every dish using the recipe
+    if not created:
+        demand.mark_recipes_dirty([instance.pk])
+
+
+# Keep the in-process name search index in sync
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, **kwargs):
+    search.ingredients.update([instance])
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(sender, instance, **kwargs):
+    search.ingredients.remove([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    search.recipes.update([instance])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    search.recipes.remove([instance.pk])
+
+
+# Recipe versions key the cached recipe representations, see food_manager.caching
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_versioned(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance.version = new_recipe_version()
+
+
+@receiver(post_save, sender=IngredientAmount)
+@receiver(post_delete, sender=IngredientAmount)
+def ingredient_line_changed(sender, instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).bump_versions()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(sender, instance, created, **kwargs):
+    # Recipes show the name, density and nutrients of their ingredients
+    if not created:
+        Recipe.objects.filter(ingredientamount__ingredient=instance).bump_versions()
+        # Shopping lists of every user are keyed by name and merged by density. After
+        # the commit, so a concurrent reader can't cache the old values again.
+        transaction.on_commit(caching.invalidate_all_shopping_lists)
+
+
+# Priced shopping lists of every user depend on the packs
+
+
+@receiver(post_save, sender=IngredientPack)
+@receiver(post_delete, sender=IngredientPack)
+def pack_changed(sender, instance, **kwargs):
+    caching.invalidate_all_shopping_lists()
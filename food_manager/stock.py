@@ -0,0 +1,80 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, FloatField, Sum, Value, When
+
+from food_manager import caching, units
+from food_manager.models import StockEntry, StockBalance
+
+# Pantry stock per user.
+#
+# Every movement is appended to the StockEntry ledger and, in the same
+# transaction, added to the user's StockBalance row with a single F() update, so
+# current stock is always one row per ingredient and unit however long the
+# ledger grows. rebuild_balances() recomputes the balances from the ledger, for
+# data written around record().
+
+NET_TOLERANCE = 1e-6
+
+
+def record(user, ingredient, unit, quantity, direction):
+    """Append a stock movement and update the balance, returns the StockEntry."""
+    (base_unit,), (amount,) = units.normalise([unit], [quantity])
+    change = amount if direction == 'in' else -amount
+
+    with transaction.atomic():
+        entry = StockEntry.objects.create(user=user, ingredient=ingredient, unit=base_unit, quantity=amount,
+                                          direction=direction)
+        balance = StockBalance.objects.filter(user=user, ingredient=ingredient, unit=base_unit)
+        if not balance.update(amount=F('amount') + change):
+            try:
+                with transaction.atomic():
+                    StockBalance.objects.create(user=user, ingredient=ingredient, unit=base_unit, amount=change)
+            except IntegrityError:
+                # A concurrent first movement created the row in the meantime
+                balance.update(amount=F('amount') + change)
+        # Netted shopping lists of this user are out of date
+        transaction.on_commit(lambda: caching.invalidate_shopping_lists([user.pk]))
+    return entry
+
+
+def rebuild_balances(ingredient_ids=None):
+    """Recompute balances from the whole ledger, or only those of ``ingredient_ids``."""
+    entries, balances = StockEntry.objects.all(), StockBalance.objects.all()
+    if ingredient_ids is not None:
+        entries = entries.filter(ingredient_id__in=ingredient_ids)
+        balances = balances.filter(ingredient_id__in=ingredient_ids)
+
+    signed = Case(When(direction='in', then=F('quantity')), default=-F('quantity'), output_field=FloatField())
+    totals = entries.values('user_id', 'ingredient_id', 'unit').annotate(amount=Sum(signed)).order_by()
+    with transaction.atomic():
+        balances.delete()
+        StockBalance.objects.bulk_create([StockBalance(**row) for row in totals], batch_size=500)
+        transaction.on_commit(caching.invalidate_all_shopping_lists)
+
+
+def net_of_stock(rows, user, merge=False):
+    """Fold demand total rows into an ingredient list, minus the user's stock on hand.
+
+    Works like aggregation.as_ingredient_list, keeping only what is still
+    missing. Reads one balance row per stocked ingredient and unit.
+    """
+    needed, names = defaultdict(float), {}
+    for row in rows:
+        unit, amount = row['base_unit'], row['total'] or 0.0
+        if merge:
+            unit, amount = units.to_mass(unit, amount, row['density'])
+        needed[(row['ingredient_pk'], unit)] += amount
+        names[row['ingredient_pk']] = (row['name'], row['density'])
+
+    balances = (StockBalance.objects.filter(user=user, ingredient_id__in=names, amount__gt=Value(0))
+                .values_list('ingredient_id', 'unit', 'amount'))
+    for ingredient_id, unit, amount in balances:
+        if merge:
+            unit, amount = units.to_mass(unit, amount, names[ingredient_id][1])
+        if (ingredient_id, unit) in needed:
+            needed[(ingredient_id, unit)] -= amount
+
+    # Unit conversions leave float residue behind when stock exactly covers the demand
+    return {f'{names[ingredient_id][0]}, {unit}': amount
+            for (ingredient_id, unit), amount in needed.items() if amount > NET_TOLERANCE}
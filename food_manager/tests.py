@@ -1,4 +1,29 @@
-from django.test import TestCase
+import csv
+import itertools
+import json
+import math
+import random
+import time
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from food_manager.aggregation import shopping_list
+from food_manager.api.serializers import RecipeSerializer
+from food_manager import caching, nutrition, packs, search, stock, units
+from food_manager.models import (Ingredient, Recipe, IngredientAmount, Meal, Dish, ExtraItems, IngredientPack,
+                                 IngredientDemand, StockBalance)
+from xvt_catering.metrics import registry
 
 # Create your tests here.
 JSON = {
@@ -240,4 +265,683 @@ JSON = {
             ]
         }
     ]
-}
\ No newline at end of file
+}
+
+
+class PlannedMealsMixin:
+    # Two days of grilled chicken lunches with an extra bottle of oil each
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        oil = Ingredient.objects.create(name='Olive Oil')
+        chicken = Ingredient.objects.create(name='Chicken Breast')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe = Recipe.objects.create(name='Grilled Chicken', instructions='Grill it', portions=2)
+            IngredientAmount.objects.create(recipe=self.recipe, ingredient=chicken, unit='kg', amount=0.4)
+            IngredientAmount.objects.create(recipe=self.recipe, ingredient=oil, unit='ml', amount=30)
+            for day in (1, 2):
+                meal = Meal.objects.create(user=self.user, date=date(2024, 1, day), meal='lu')
+                Dish.objects.create(meal=meal, recipe=self.recipe, portions=3)
+                ExtraItems.objects.create(meal=meal, item=oil, unit='lt', amount=0.5)
+
+
+class ShoppingListTests(PlannedMealsMixin, TestCase):
+    def assertIngredientList(self, ingredient_list, expected):
+        self.assertEqual(set(ingredient_list), set(expected))
+        for key, amount in expected.items():
+            self.assertAlmostEqual(ingredient_list[key], amount)
+
+    def test_totals_are_scaled_and_include_extras(self):
+        with self.assertNumQueries(2):
+            ingredient_list = shopping_list(Meal.objects.filter(date__range=(date(2024, 1, 1), date(2024, 1, 2))))
+
+        self.assertIngredientList(ingredient_list, {'Chicken Breast, gr': 1200.0, 'Olive Oil, ml': 1090.0})
+
+    def test_demand_table_follows_writes(self):
+        with self.assertNumQueries(1):
+            ingredient_list = Meal.extract_ingredient_list(date(2024, 1, 1), date(2024, 1, 2))
+        self.assertIngredientList(ingredient_list, {'Chicken Breast, gr': 1200.0, 'Olive Oil, ml': 1090.0})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.portions = 3
+            self.recipe.save()
+            Meal.objects.get(date=date(2024, 1, 2)).delete()
+
+        self.assertIngredientList(Meal.extract_ingredient_list(date(2024, 1, 1), date(2024, 1, 2)),
+                                  {'Chicken Breast, gr': 400.0, 'Olive Oil, ml': 530.0})
+
+    def test_merge_converts_volume_with_density(self):
+        Ingredient.objects.filter(name='Olive Oil').update(density=0.9)
+        ingredient_list = Meal.extract_ingredient_list(date(2024, 1, 1), date(2024, 1, 2), merge=True)
+        self.assertIngredientList(ingredient_list, {'Chicken Breast, gr': 1200.0, 'Olive Oil, gr': 981.0})
+
+
+class MealReadQueryTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.ingredients = [Ingredient.objects.create(name=f'Ingredient {i}') for i in range(3)]
+
+    def plan_meals(self, first_day, last_day):
+        for day in range(first_day, last_day + 1):
+            meal = Meal.objects.create(user=self.user, date=date(2024, 1, day), meal='lu')
+            for number in range(2):
+                recipe = Recipe.objects.create(name=f'Recipe {day}.{number}', instructions='Cook', portions=2)
+                for ingredient in self.ingredients:
+                    IngredientAmount.objects.create(recipe=recipe, ingredient=ingredient, unit='gr', amount=100)
+                Dish.objects.create(meal=meal, recipe=recipe, portions=2)
+            ExtraItems.objects.create(meal=meal, item=self.ingredients[0], unit='unt', amount=1)
+
+    def test_meal_range_query_count_does_not_grow_with_meals(self):
+        planned = 0
+        for days in (1, 7):
+            self.plan_meals(planned + 1, days)
+            planned = days
+            # meals, dishes + recipes, ingredient amounts + ingredients, extras + items
+            with self.assertNumQueries(4):
+                response = self.client.get('/api/meals/get_range/2024-01-01/2024-01-31/')
+            self.assertEqual(len(response.json()), days)
+
+        meal = response.json()[0]
+        self.assertEqual(len(meal['dishes']), 2)
+        self.assertEqual(len(meal['dishes'][0]['recipe']['ingredients']), 3)
+        self.assertEqual(meal['extras'][0]['item']['name'], 'Ingredient 0')
+
+
+class RecipeWriteTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Ingredient.objects.create(name='Ingredient 0')
+
+    def recipe_data(self, lines, amount=10):
+        return {
+            'name': 'Big Stew',
+            'instructions': 'Stew everything',
+            'portions': 10,
+            'ingredients': [{'ingredient': {'name': f'Ingredient {i}'}, 'unit': 'gr', 'amount': amount}
+                            for i in range(lines)],
+        }
+
+    def test_recipe_writes_are_batched(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/recipes/add/', self.recipe_data(30), format='json')
+        self.assertEqual(response.status_code, 201)
+        # A constant handful of statements, savepoints included, instead of two per ingredient line
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(Ingredient.objects.count(), 30)
+
+        recipe = Recipe.objects.get(pk=response.json()['id'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(f'/api/recipes/update/{recipe.pk}/', self.recipe_data(31, amount=20),
+                                       format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 15)
+        self.assertEqual(recipe.ingredientamount_set.count(), 31)
+        self.assertEqual(set(recipe.ingredientamount_set.values_list('amount', flat=True)), {20})
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_lines_are_imported_and_reported(self):
+        recipe = {'name': 'Tea', 'instructions': 'Brew', 'portions': 1,
+                  'ingredients': [{'ingredient': {'name': 'Green Tea'}, 'unit': 'gr', 'amount': 5}]}
+        meal = {'date': '2024-01-02', 'meal': 'br', 'dishes': [{'recipe': recipe, 'portions': 2}],
+                'extras': [{'item': {'name': 'Avocado'}, 'unit': 'unt', 'amount': 1}]}
+        body = '\n'.join([
+            json.dumps({'type': 'recipe', 'data': recipe}),
+            'not json',
+            '',
+            json.dumps({'type': 'meal', 'data': meal}),
+            json.dumps({'type': 'meal', 'data': meal}),
+        ])
+
+        response = self.client.post('/api/bulk/import/?chunk_size=2', body, content_type='application/x-ndjson')
+        results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual([(result['line'], result['status']) for result in results],
+                         [(1, 'created'), (2, 'error'), (4, 'created'), (5, 'error')])
+        self.assertEqual(Recipe.objects.get().ingredientamount_set.count(), 1)
+        self.assertEqual(Meal.objects.filter(user=self.user).count(), 1)
+
+    def test_save_errors_are_reported_per_line(self):
+        def create(validated_data):
+            if validated_data['name'] == 'Coffee':
+                raise Recipe.DoesNotExist('Recipe matching query does not exist.')
+            validated_data.pop('ingredients')
+            return Recipe.objects.create(**validated_data)
+
+        lines = [json.dumps({'type': 'recipe', 'data': {'name': name, 'instructions': 'Brew', 'portions': 1,
+                                                        'ingredients': []}})
+                 for name in ('Tea', 'Coffee')]
+        with mock.patch.object(RecipeSerializer, 'create', side_effect=create):
+            response = self.client.post('/api/bulk/import/', '\n'.join(lines), content_type='application/x-ndjson')
+            results = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        self.assertEqual([result['status'] for result in results], ['created', 'error'])
+        self.assertTrue(Recipe.objects.filter(name='Tea').exists())
+
+
+class ExportTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_meal_export_matches_range_endpoint(self):
+        expected = self.client.get('/api/meals/get_range/2024-01-01/2024-01-31/').json()
+        response = self.client.get('/api/meals/export_range/2024-01-01/2024-01-31/ndjson/')
+        exported = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(exported, expected)
+
+        response = self.client.get('/api/meals/export_range/2024-01-01/2024-01-31/csv/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        # header, two ingredient rows and one extra per meal
+        self.assertEqual(len(lines), 1 + 2 * 3)
+
+    def test_shopping_list_export(self):
+        response = self.client.get('/api/meals/export_shopping_list/2024-01-01/2024-01-31/csv/')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual([row[:2] for row in rows], [['ingredient', 'unit'], ['Chicken Breast', 'gr'], ['Olive Oil', 'ml']])
+        self.assertAlmostEqual(float(rows[1][2]), 1200.0)
+
+
+class UnitRegistryTests(SimpleTestCase):
+    def test_every_stored_code_is_registered(self):
+        for model in (IngredientAmount, ExtraItems):
+            for code, _ in model.UNITS_CHOICES:
+                self.assertIn(code, units.UNITS)
+
+    def test_normalise(self):
+        base_units, amounts = units.normalise(['tbl', 'tsp', 'kg', 'cl', 'xyz'], [2, 3, 0.5, 4, 1])
+        self.assertEqual(base_units, ['ml', 'ml', 'gr', 'cl', 'xyz'])
+        self.assertEqual(amounts, [30.0, 15.0, 500.0, 4.0, 1])
+
+
+class DemandAutocommitTests(TransactionTestCase):
+    # Outside atomic() commit callbacks run as soon as they are scheduled
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.other_user = get_user_model().objects.create_user(username='other', password='secret')
+        recipe = Recipe.objects.create(name='Boiled Rice', instructions='Boil it', portions=1)
+        IngredientAmount.objects.create(recipe=recipe, ingredient=Ingredient.objects.create(name='Rice'),
+                                        unit='gr', amount=100)
+        self.meal = Meal.objects.create(user=self.user, date=date(2024, 1, 1), meal='lu')
+        self.dish = Dish.objects.create(meal=self.meal, recipe=recipe, portions=1)
+
+    def demand(self, user, day):
+        return dict(IngredientDemand.objects.filter(user=user, date=day).values_list('ingredient__name', 'amount'))
+
+    def test_meal_moved_to_another_day(self):
+        self.meal.date = date(2024, 1, 2)
+        self.meal.save()
+        self.assertEqual(self.demand(self.user, date(2024, 1, 1)), {})
+        self.assertEqual(self.demand(self.user, date(2024, 1, 2)), {'Rice': 100.0})
+
+    def test_meal_given_to_another_user(self):
+        self.meal.user = self.other_user
+        self.meal.save()
+        self.assertEqual(self.demand(self.user, date(2024, 1, 1)), {})
+        self.assertEqual(self.demand(self.other_user, date(2024, 1, 1)), {'Rice': 100.0})
+
+    def test_dish_moved_to_another_meal(self):
+        self.dish.meal = Meal.objects.create(user=self.user, date=date(2024, 1, 3), meal='dr')
+        self.dish.save()
+        self.assertEqual(self.demand(self.user, date(2024, 1, 1)), {})
+        self.assertEqual(self.demand(self.user, date(2024, 1, 3)), {'Rice': 100.0})
+
+
+class ShoppingListEndpointTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        other_user = get_user_model().objects.create_user(username='other', password='secret')
+        with self.captureOnCommitCallbacks(execute=True):
+            meal = Meal.objects.create(user=other_user, date=date(2024, 1, 1), meal='dr')
+            Dish.objects.create(meal=meal, recipe=self.recipe, portions=100)
+
+    def test_scoped_to_user_and_cached(self):
+        url = '/api/meals/get_shopping_list/2024-01-01/2024-01-02/'
+        first = self.client.get(url).json()['ingredient_list']
+        self.assertAlmostEqual(first['Chicken Breast, gr'], 1200.0)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()['ingredient_list'], first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Dish.objects.filter(meal__user=self.user).first().delete()
+        self.assertAlmostEqual(self.client.get(url).json()['ingredient_list']['Chicken Breast, gr'], 600.0)
+
+        # Lists are keyed by ingredient name
+        chicken = Ingredient.objects.get(name='Chicken Breast')
+        chicken.name = 'Chicken Fillet'
+        with self.captureOnCommitCallbacks(execute=True):
+            chicken.save()
+        self.assertIn('Chicken Fillet, gr', self.client.get(url).json()['ingredient_list'])
+
+
+class TracingTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(TRACING={'ENABLED': True, 'DEFAULT_SAMPLE_RATE': 0.0,
+                                'SAMPLE_RATES': {'get_meals_between_dates': 1.0}})
+    def test_sampled_endpoint_emits_one_trace(self):
+        with self.assertLogs('food_manager.trace', level='INFO') as logs:
+            self.client.get('/api/meals/get_range/2024-01-01/2024-01-31/')
+            self.client.get('/api/meals/get/1/')
+
+        self.assertEqual(len(logs.records), 1)
+        trace = json.loads(logs.records[0].getMessage())
+        self.assertEqual(trace['endpoint'], 'get_meals_between_dates')
+        self.assertEqual([span['name'] for span in trace['spans']], ['meals.serialize', 'view'])
+
+
+class RequestMetricsTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_metrics_are_aggregated_per_route(self):
+        self.client.get('/api/meals/get_range/2024-01-01/2024-01-31/')
+        self.client.get('/api/meals/get_range/2024-02-01/2024-02-28/')
+
+        metrics = self.client.get('/api/metrics').content.decode()
+        labels = 'route="api/meals/get_range/<str:start_date>/<str:end_date>/",method="GET"'
+        self.assertIn(f'xvt_requests_total{{{labels},status="200"}} 2', metrics)
+        self.assertIn(f'xvt_request_db_queries_count{{{labels}}} 2', metrics)
+        # four queries for the populated month, one for the empty one
+        self.assertIn(f'xvt_request_db_queries_sum{{{labels}}} 5', metrics)
+
+
+class MealWriteTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def meal_data(self, dishes):
+        return {
+            'date': '2024-01-02', 'meal': 'lu',
+            'dishes': [{'recipe': {'name': f'Recipe {number}', 'instructions': 'Cook', 'portions': 2,
+                                   'ingredients': [{'ingredient': {'name': 'Rice'}, 'unit': 'gr', 'amount': 100}]},
+                        'portions': 4}
+                       for number in range(dishes)],
+            'extras': [{'item': {'name': 'Green Tea'}, 'unit': 'ml', 'amount': 300},
+                       {'item': {'name': 'Avocado'}, 'unit': 'unt', 'amount': 1}],
+        }
+
+    def test_meal_contents_are_written_in_bulk(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/meals/add/', self.meal_data(10), format='json')
+        self.assertEqual(response.status_code, 201)
+        # A constant handful of statements, savepoints included
+        self.assertLessEqual(len(queries), 20)
+
+        meal = Meal.objects.get(pk=response.json()['id'])
+        self.assertEqual(meal.dish_set.count(), 10)
+        self.assertEqual(meal.extraitems_set.count(), 2)
+        self.assertEqual(IngredientAmount.objects.filter(ingredient__name='Rice').count(), 10)
+
+    def test_failed_meal_leaves_nothing_behind(self):
+        self.client.post('/api/meals/add/', self.meal_data(1), format='json')
+        response = self.client.post('/api/meals/add/', self.meal_data(3), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Meal.objects.count(), 1)
+        self.assertEqual(Dish.objects.count(), 1)
+
+
+class MealCloneTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def clone(self, target_start, repeat):
+        data = {'source_start': '2024-01-01', 'source_end': '2024-01-07', 'target_start': target_start,
+                'repeat': repeat}
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/meals/clone/', data, format='json')
+
+    def test_week_is_cloned_in_a_few_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.clone('2024-01-08', 12)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'meals': 24, 'dishes': 24, 'extras': 24})
+        # Independent of the number of copies, demand refresh included
+        self.assertLessEqual(len(queries), 15)
+
+        self.assertEqual(Meal.objects.filter(date=date(2024, 3, 25)).count(), 1)
+        self.assertEqual(Dish.objects.filter(meal__date=date(2024, 3, 26), portions=3).count(), 1)
+        ingredient_list = Meal.extract_ingredient_list(date(2024, 3, 25), date(2024, 3, 26), user=self.user)
+        self.assertAlmostEqual(ingredient_list['Chicken Breast, gr'], 1200.0)
+
+    def test_clone_onto_planned_days_writes_nothing(self):
+        response = self.clone('2024-01-02', 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Meal.objects.count(), 2)
+
+    def test_meal_planned_during_the_clone_is_a_conflict(self):
+        # Another request took a target slot between the check and the insert
+        with mock.patch.object(Meal.objects, 'bulk_create', side_effect=IntegrityError('UNIQUE constraint failed')):
+            response = self.clone('2024-01-08', 1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Meal.objects.count(), 2)
+
+
+class MealRangeTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_shift_onto_overlapping_days(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/meals/shift/', {'start_date': '2024-01-01', 'end_date': '2024-01-02',
+                                                              'days': 1}, format='json')
+        self.assertEqual(response.json(), {'moved': 2})
+        self.assertEqual(sorted(Meal.objects.values_list('date', 'meal')),
+                         [(date(2024, 1, 2), 'lu'), (date(2024, 1, 3), 'lu')])
+        self.assertEqual(Dish.objects.filter(meal__date=date(2024, 1, 3)).count(), 1)
+        ingredient_list = Meal.extract_ingredient_list(date(2024, 1, 1), date(2024, 1, 1), user=self.user)
+        self.assertEqual(ingredient_list, {})
+
+    def test_shift_onto_meal_outside_range_is_rejected(self):
+        response = self.client.post('/api/meals/shift/', {'start_date': '2024-01-01', 'end_date': '2024-01-01',
+                                                          'days': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Meal.objects.filter(date=date(2024, 1, 1)).count(), 1)
+
+    def test_delete_range_and_update(self):
+        meal = Meal.objects.get(date=date(2024, 1, 2))
+        response = self.client.patch(f'/api/meals/update/{meal.pk}/', {'meal': 'dr', 'dishes': []}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['dishes'], [])
+        self.assertEqual(len(response.json()['extras']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/meals/delete_range/2024-01-01/2024-01-31/')
+        self.assertEqual(response.json(), {'deleted': 2})
+        self.assertFalse(Dish.objects.exists() or ExtraItems.objects.exists())
+        self.assertEqual(Meal.extract_ingredient_list(date(2024, 1, 1), date(2024, 1, 2)), {})
+
+
+class PaginationTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def collect(self, url):
+        names, pages = [], 0
+        while url:
+            response = self.client.get(url).json()
+            names.extend(response['results'])
+            url, pages = response['next'], pages + 1
+        return names, pages
+
+    def test_cursor_pages_cover_every_row_once(self):
+        Ingredient.objects.bulk_create([Ingredient(name=f'Spice {number}') for number in range(5)])
+        ingredients, pages = self.collect('/api/ingredients/list/?page_size=3')
+        self.assertEqual(pages, 3)
+        self.assertEqual([ingredient['name'] for ingredient in ingredients],
+                         list(Ingredient.objects.order_by('id').values_list('name', flat=True)))
+
+        meals, pages = self.collect('/api/meals/list/?page_size=1&start_date=2024-01-02')
+        self.assertEqual([meal['date'] for meal in meals], ['2024-01-02'])
+        self.assertEqual(len(meals[0]['dishes']), 1)
+
+        recipes, _ = self.collect('/api/recipes/list/')
+        self.assertEqual(recipes[0]['name'], 'Grilled Chicken')
+
+
+class NameSearchTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='chef', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for name in ('Olive Oil', 'Olives', 'Chicken Breast', 'Chicken Thigh', 'Tray 1'):
+            Ingredient.objects.create(name=name)
+        search.ingredients.clear()
+        search.recipes.clear()
+
+    def test_prefix_and_fuzzy_matches(self):
+        results = self.client.get('/api/ingredients/search/?q=oli').json()['results']
+        self.assertEqual([result['name'] for result in results[:2]], ['Olive Oil', 'Olives'])
+
+        results = self.client.get('/api/ingredients/search/?q=chiken brest').json()['results']
+        self.assertEqual(results[0]['name'], 'Chicken Breast')
+
+        # Writes reach the loaded index once they commit
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Oregano')
+        with self.assertNumQueries(0):
+            self.assertEqual(search.ingredients.search('oreg')[0][1], 'Oregano')
+
+    def test_near_duplicate_names_are_rejected(self):
+        response = self.client.post('/api/ingredients/add/', {'name': 'olive  oil'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/ingredients/add/', {'name': 'Chicken Breasts'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        for name in ('Chicken Wings', 'Tray 2'):
+            response = self.client.post('/api/ingredients/add/', {'name': name}, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        # Nested names reuse the existing row instead
+        recipe = {'name': 'Salad', 'instructions': 'Toss', 'portions': 1,
+                  'ingredients': [{'ingredient': {'name': 'olive oil'}, 'unit': 'ml', 'amount': 10}]}
+        self.assertEqual(self.client.post('/api/recipes/add/', recipe, format='json').status_code, 201)
+        self.assertEqual(Ingredient.objects.filter(name__iexact='olive oil').count(), 1)
+
+
+class DedupeIngredientsTests(PlannedMealsMixin, TestCase):
+    def test_duplicates_are_merged_and_amounts_summed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            # 'Grilled Chicken' already has 30 ml of 'Olive Oil'
+            olive_oil = Ingredient.objects.create(name='olive  oil')
+            IngredientAmount.objects.create(recipe=self.recipe, ingredient=olive_oil, unit='tbl', amount=2)
+            plural = Ingredient.objects.create(name='Olive Oils')
+            ExtraItems.objects.create(meal=Meal.objects.get(date=date(2024, 1, 1)), item=plural, unit='ml', amount=10)
+            Ingredient.objects.create(name='Olives')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('dedupe_ingredients', stdout=StringIO())
+
+        self.assertEqual(sorted(Ingredient.objects.values_list('name', flat=True)),
+                         ['Chicken Breast', 'Olive Oil', 'Olives'])
+        self.assertEqual(self.recipe.ingredientamount_set.get(ingredient__name='Olive Oil').amount, 60)
+        ingredient_list = Meal.extract_ingredient_list(date(2024, 1, 1), date(2024, 1, 2))
+        self.assertAlmostEqual(ingredient_list['Olive Oil, ml'], 2 * 90 + 1000 + 10)
+
+
+class RecipeRepresentationCacheTests(PlannedMealsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caching.recipe_representations.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_are_served_from_cache_until_they_change(self):
+        with self.assertNumQueries(2):
+            first = self.client.get(f'/api/recipes/get/{self.recipe.pk}/').json()
+        # The cached copy needs only the recipe row for its version
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(f'/api/recipes/get/{self.recipe.pk}/').json(), first)
+
+        chicken = Ingredient.objects.get(name='Chicken Breast')
+        chicken.name = 'Chicken Thighs'
+        chicken.save()
+        IngredientAmount.objects.filter(ingredient__name='Olive Oil').get().delete()
+        recipe = self.client.get(f'/api/recipes/get/{self.recipe.pk}/').json()
+        self.assertEqual([line['ingredient']['name'] for line in recipe['ingredients']], ['Chicken Thighs'])
+
+        meals = self.client.get('/api/meals/get_range/2024-01-01/2024-01-02/').json()
+        self.assertEqual([meal['dishes'][0]['recipe'] for meal in meals], [recipe, recipe])
+
+    @override_settings(REPRESENTATION_SHARED_CACHE='default')
+    async def test_async_lookups_share_entries_with_other_workers(self):
+        cache.clear()
+        await caching.recipe_representations.aset(('shared', 1), {'name': 'Tea'})
+        # Another worker, with nothing in its own LRU
+        caching.recipe_representations.clear()
+        self.assertEqual(await caching.recipe_representations.aget(('shared', 1)), {'name': 'Tea'})
+        self.assertEqual(caching.recipe_representations.get(('shared', 1)), {'name': 'Tea'})
+
+
+class AsyncReadEndpointTests(PlannedMealsMixin, TestCase):
+    async def test_async_endpoints_match_the_sync_ones(self):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        for path in (f'recipes/get/{self.recipe.pk}/', 'meals/get_range/2024-01-01/2024-01-02/',
+                     'meals/get_shopping_list/2024-01-01/2024-01-02/?merge=1'):
+            response = await self.async_client.get(f'/api/async/{path}', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            expected = await sync_to_async(client.get)(f'/api/{path}')
+            self.assertEqual(response.json(), expected.json())
+
+        # The user was cached through the async cache API
+        self.assertIsNotNone(await cache.aget(f'auth_user:{self.user.pk}'))
+
+        response = await self.async_client.get(f'/api/async/meals/get/{self.recipe.pk + 1000}/', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(f'/api/async/recipes/get/{self.recipe.pk}/')
+        self.assertEqual(response.status_code, 401)
+
+
+class PackPlanTests(PlannedMealsMixin, TestCase):
+    def test_cheapest_packs_cover_the_demand(self):
+        # 1 kg bags are the best value, one 400 g bag beats a third kilo bag for the rest
+        counts, cost = packs.cheapest_packs(2300, [(400, 3.0), (1000, 6.0), (250, 2.5)])
+        self.assertEqual((counts, cost), ([1, 2, 0], 15.0))
+        # A search cut short still returns a basket that covers the demand
+        counts, cost = packs.cheapest_packs(10007, [(997, 5.0), (1009, 5.06)], max_nodes=3)
+        self.assertGreaterEqual(counts[0] * 997 + counts[1] * 1009, 10007)
+        # Fractional sizes are never rounded up
+        counts, cost = packs.cheapest_packs(1.2, [(0.5, 1.0), (0.25, 0.6)])
+        self.assertGreaterEqual(counts[0] * 0.5 + counts[1] * 0.25, 1.2)
+
+    def test_awkward_pack_sizes_stay_fast(self):
+        # Coprime catalogue sizes and large demands, the case a table over the demand can't handle
+        rng = random.Random(1)
+        sizes = [330, 454, 500, 907, 1000, 2270]
+        cases = [(rng.uniform(200, 500000), [(size, round(size / 1000 * rng.uniform(3, 9), 2))
+                                             for size in rng.sample(sizes, rng.randint(2, 6))])
+                 for _ in range(200)]
+        started = time.perf_counter()
+        for demand, options in cases:
+            packs.cheapest_packs(demand, options)
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+    def test_cheapest_packs_match_brute_force(self):
+        rng = random.Random(0)
+        # Litres and grams, demands of a few dozen packs at most so every basket can be tried
+        families = [([0.25, 0.33, 0.5, 0.75, 1, 1.5], [0.8, 1.2, 2.1, 3.3]),
+                    ([100, 125, 200, 250, 400, 500, 1000], [450, 999, 2210, 3125])]
+        for _ in range(300):
+            sizes, demands = rng.choice(families)
+            options = [(rng.choice(sizes), round(rng.uniform(1, 10), 2)) for _ in range(3)]
+            demand = rng.choice(demands)
+            counts, cost = packs.cheapest_packs(demand, options)
+            self.assertGreaterEqual(sum(count * size for count, (size, _) in zip(counts, options)), demand - 1e-9)
+
+            # Every count of the first two packs, topped up with as few of the third as needed
+            (first, first_price), (second, second_price), (third, third_price) = options
+            best = min(a * first_price + b * second_price
+                       + max(math.ceil((demand - a * first - b * second) / third - 1e-9), 0) * third_price
+                       for a, b in itertools.product(range(math.ceil(demand / first) + 1),
+                                                     range(math.ceil(demand / second) + 1)))
+            self.assertAlmostEqual(cost, best, msg=f'{demand} {options}')
+
+    def test_priced_shopping_list(self):
+        cache.clear()
+        chicken = Ingredient.objects.get(name='Chicken Breast')
+        IngredientPack.objects.create(ingredient=chicken, size=1, unit='kg', price='9.50')
+        IngredientPack.objects.create(ingredient=chicken, size=250, unit='gr', price='3.00')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        body = client.get('/api/meals/get_shopping_list/2024-01-01/2024-01-02/?mode=packs').json()
+        # 1200 g of chicken: one kilo bag and one 250 g bag
+        self.assertEqual(body['packs']['Chicken Breast, gr']['cost'], 12.5)
+        self.assertEqual(body['unpriced'], ['Olive Oil, ml'])
+        self.assertEqual(body['total_cost'], 12.5)
+
+
+class StockTests(PlannedMealsMixin, TestCase):
+    def test_net_shopping_list(self):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = '/api/meals/get_shopping_list/2024-01-01/2024-01-02/?mode=net'
+        self.assertAlmostEqual(client.get(url).json()['ingredient_list']['Chicken Breast, gr'], 1200.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for quantity, unit, direction in ((1, 'kg', 'in'), (0.5, 'kg', 'in'), (300, 'gr', 'out')):
+                response = client.post('/api/stock/add/', {'ingredient': {'name': 'chicken breast'}, 'unit': unit,
+                                                           'quantity': quantity, 'direction': direction},
+                                       format='json')
+                self.assertEqual(response.status_code, 201)
+
+        response = client.post('/api/stock/add/', {'ingredient': {'name': 'Chicken Breast'}, 'unit': 'gr',
+                                                   'quantity': 0, 'direction': 'in'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # One running balance in grams, whatever the length of the ledger
+        self.assertEqual(StockBalance.objects.get(user=self.user).amount, 1200.0)
+        self.assertEqual(client.get('/api/stock/get/').json()['stock'], {'Chicken Breast, gr': 1200.0})
+        # Covered by stock, so nothing left to buy
+        self.assertNotIn('Chicken Breast, gr', client.get(url).json()['ingredient_list'])
+        # Same list from the async route
+        response = async_to_sync(self.async_client.get)(url.replace('/api/', '/api/async/'), headers={
+            'Authorization': f'Bearer {AccessToken.for_user(self.user)}'})
+        self.assertEqual(response.json(), client.get(url).json())
+
+        StockBalance.objects.all().delete()
+        stock.rebuild_balances()
+        self.assertEqual(StockBalance.objects.get(user=self.user).amount, 1200.0)
+
+
+class NutritionTests(PlannedMealsMixin, TestCase):
+    def test_rollup_scales_like_the_shopping_list(self):
+        Ingredient.objects.filter(name='Chicken Breast').update(energy_kcal=165, protein=31, fat=3.6, carbohydrates=0)
+        Ingredient.objects.filter(name='Olive Oil').update(energy_kcal=884, protein=0, fat=100, carbohydrates=0,
+                                                          density=0.91)
+        egg = Ingredient.objects.create(name='Egg', energy_kcal=143)
+        ExtraItems.objects.create(meal=Meal.objects.get(date=date(2024, 1, 2)), item=egg, unit='unt', amount=2)
+
+        # Dish lines, extras and the nutrient columns, however many meals
+        with self.assertNumQueries(3):
+            totals, incomplete = nutrition.rollup(Meal.objects.filter(user=self.user))
+        # 600 g of chicken and 45 + 500 ml of oil per lunch, weighed through its density
+        for meal_totals in totals.values():
+            self.assertAlmostEqual(meal_totals['energy_kcal'], 6 * 165 + 5.45 * 0.91 * 884)
+            self.assertAlmostEqual(meal_totals['fat'], 6 * 3.6 + 545 * 0.91)
+        # Eggs are counted in units, not grams
+        self.assertEqual(incomplete, ['Egg'])
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        body = client.get('/api/meals/nutrition/2024-01-01/2024-01-02/').json()
+        self.assertEqual(body['days']['2024-01-01']['energy_kcal'], 5374.2)
+        self.assertEqual(body['total']['protein'], 372.0)
+        self.assertEqual([meal['date'] for meal in body['meals']], ['2024-01-01', '2024-01-02'])
+
+        # Meals of a day in the order they are eaten, not by code
+        for code in ('sn', 'dr', 'br'):
+            Meal.objects.create(user=self.user, date=date(2024, 1, 1), meal=code)
+        body = client.get('/api/meals/nutrition/2024-01-01/2024-01-01/').json()
+        self.assertEqual([meal['meal'] for meal in body['meals']], ['br', 'lu', 'dr', 'sn'])
@@ -0,0 +1,138 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+import uuid
+
+from django.conf import settings
+
+# Lightweight request tracing.
+#
+# Views decorated with @traced('<endpoint>') start a trace for a sampled fraction of
+# their requests (TRACING['SAMPLE_RATES'], falling back to DEFAULT_SAMPLE_RATE).
+# Code on the request path wraps interesting work in `with span('name'):`. Each
+# finished trace is written as one JSON line to the 'food_manager.trace' logger.
+# Outside a sampled trace, span() hands back a shared no-op object, so an
+# unsampled or disabled request pays for a context variable lookup and nothing else.
+
+logger = logging.getLogger('food_manager.trace')
+
+_current_trace = contextvars.ContextVar('food_manager_trace', default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ('trace', 'name', 'attributes', 'started')
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.started = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration_ms = (time.perf_counter() - self.started) * 1000
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.spans.append({
+            'name': self.name,
+            'start_ms': round((self.started - self.trace.started) * 1000, 3),
+            'duration_ms': round(duration_ms, 3),
+            **self.attributes,
+        })
+        return False
+
+
+class Trace:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def emit(self):
+        logger.info(json.dumps({
+            'trace_id': self.trace_id,
+            'endpoint': self.endpoint,
+            'duration_ms': round((time.perf_counter() - self.started) * 1000, 3),
+            'spans': self.spans,
+        }, default=str))
+
+
+def span(name, **attributes):
+    """Time a block as part of the current trace, a no-op when the request isn't sampled."""
+    trace = _current_trace.get()
+    if trace is None:
+        return NOOP_SPAN
+    return Span(trace, name, attributes)
+
+
+def _sampled(endpoint):
+    config = settings.TRACING
+    if not config.get('ENABLED'):
+        return False
+    rate = config.get('SAMPLE_RATES', {}).get(endpoint, config.get('DEFAULT_SAMPLE_RATE', 0.0))
+    return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+def traced(endpoint):
+    """Decorate a view function, sync or async, so a sampled share of its requests is traced as ``endpoint``."""
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if not _sampled(endpoint):
+                    return await view(request, *args, **kwargs)
+
+                trace = Trace(endpoint)
+                token = _current_trace.set(trace)
+                try:
+                    with Span(trace, 'view', {'method': request.method}) as view_span:
+                        response = await view(request, *args, **kwargs)
+                        view_span.set(status=getattr(response, 'status_code', None))
+                        return response
+                finally:
+                    _current_trace.reset(token)
+                    trace.emit()
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _sampled(endpoint):
+                return view(request, *args, **kwargs)
+
+            trace = Trace(endpoint)
+            token = _current_trace.set(trace)
+            try:
+                with Span(trace, 'view', {'method': request.method}) as view_span:
+                    response = view(request, *args, **kwargs)
+                    view_span.set(status=getattr(response, 'status_code', None))
+                    return response
+            finally:
+                _current_trace.reset(token)
+                trace.emit()
+        return wrapper
+    return decorator
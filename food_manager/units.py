@@ -0,0 +1,122 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from django.db.models import Case, CharField, F, FloatField, Value, When
+
+# Unit registry shared by the models, the shopping list aggregation and the serializers.
+# Built once at import: every stored unit code maps to a dimension and to the factor
+# that converts it into that dimension's base unit. Aggregation converts inside the
+# database with the db_factor/db_base_unit expressions built from this registry, so
+# grouped sums never bring rows into Python; normalise() is the entry point for
+# amounts that are already in Python, such as stock movements.
+
+UNITS_CHOICES = [
+    ('gr', 'grams'),
+    ('kg', 'kilograms'),
+    ('ml', 'milliliters'),
+    ('lt', 'liters'),
+    ('unt', 'units'),
+    ('cl', 'cloves'),
+    ('tsp', 'teaspoon'),
+    ('cp', 'cup'),
+    ('tbl', 'tablespoon')
+]
+
+BASE_UNITS = {
+    'mass': 'gr',
+    'volume': 'ml',
+    'count': 'unt',
+    'clove': 'cl',
+}
+
+Unit = namedtuple('Unit', ['code', 'dimension', 'base', 'factor'])
+
+_CONVERSIONS = {
+    'gr': ('mass', 1),
+    'kg': ('mass', 1000),
+    'ml': ('volume', 1),
+    'lt': ('volume', 1000),
+    'tsp': ('volume', 5),
+    'tbl': ('volume', 15),
+    'cp': ('volume', 240),
+    'unt': ('count', 1),
+    'cl': ('clove', 1),
+}
+
+# A KeyError here means a code was added to UNITS_CHOICES without a conversion
+UNITS = {
+    code: Unit(code, _CONVERSIONS[code][0], BASE_UNITS[_CONVERSIONS[code][0]], float(_CONVERSIONS[code][1]))
+    for code, _ in UNITS_CHOICES
+}
+
+
+def normalise(units, amounts):
+    """Convert parallel sequences of unit codes and amounts to base units.
+
+    Returns ``(base_units, base_amounts)`` as two lists. Unknown codes are passed
+    through unchanged. One registry lookup per element; querysets should use
+    db_factor and db_base_unit instead, which do the same conversion in SQL.
+    """
+    base_units, base_amounts = [], []
+    for code, amount in zip(units, amounts):
+        unit = UNITS.get(code)
+        if unit is None:
+            base_units.append(code)
+            base_amounts.append(amount)
+        else:
+            base_units.append(unit.base)
+            base_amounts.append(amount * unit.factor)
+    return base_units, base_amounts
+
+
+def to_mass(base_unit, amount, density):
+    """Convert a volume amount in base units to grams, given a density in g/ml.
+
+    Anything that isn't a volume, or has no density, is returned unchanged.
+    """
+    if density and base_unit == BASE_UNITS['volume']:
+        return BASE_UNITS['mass'], amount * density
+    return base_unit, amount
+
+
+def convert(amount, code, target, density=None):
+    """Convert ``amount`` from unit ``code`` to unit ``target``.
+
+    Mass and volume convert into each other through ``density`` (g/ml). Returns
+    None when the units can't be converted.
+    """
+    if code == target:
+        return amount
+    source, destination = UNITS.get(code), UNITS.get(target)
+    if source is None or destination is None:
+        return None
+    base = amount * source.factor
+    if source.dimension != destination.dimension:
+        if not density or {source.dimension, destination.dimension} != {'mass', 'volume'}:
+            return None
+        base = base * density if source.dimension == 'volume' else base / density
+    return base / destination.factor
+
+
+@lru_cache(maxsize=None)
+def db_factor(unit_field):
+    """Database expression of the base-unit factor of the codes stored in ``unit_field``."""
+    return Case(
+        *[When(**{unit_field: unit.code}, then=Value(unit.factor)) for unit in UNITS.values() if unit.factor != 1],
+        default=Value(1.0),
+        output_field=FloatField(),
+    )
+
+
+@lru_cache(maxsize=None)
+def db_base_unit(unit_field):
+    """Database expression of the base unit of the codes stored in ``unit_field``."""
+    by_base = {}
+    for unit in UNITS.values():
+        if unit.code != unit.base:
+            by_base.setdefault(unit.base, []).append(unit.code)
+    return Case(
+        *[When(**{f'{unit_field}__in': codes}, then=Value(base)) for base, codes in by_base.items()],
+        default=F(unit_field),
+        output_field=CharField(),
+    )
@@ -0,0 +1,104 @@
+import bisect
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+# Process-local request metrics, aggregated per URL pattern and rendered in the
+# Prometheus text exposition format by metrics_view (/api/metrics).
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+HISTOGRAMS = (
+    ('xvt_request_duration_seconds', 'Wall time spent handling the request', DURATION_BUCKETS),
+    ('xvt_request_db_queries', 'Database queries executed by the request', QUERY_COUNT_BUCKETS),
+    ('xvt_request_db_duration_seconds', 'Time spent in database queries', DURATION_BUCKETS),
+    ('xvt_response_size_bytes', 'Size of the response body (non-streaming responses)', SIZE_BUCKETS),
+)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = {}
+
+    def observe(self, route, method, status, duration, queries, db_duration, size):
+        labels = (route, method)
+        with self._lock:
+            histograms = self._histograms.get(labels)
+            if histograms is None:
+                histograms = self._histograms[labels] = {name: Histogram(buckets) for name, _, buckets in HISTOGRAMS}
+            histograms['xvt_request_duration_seconds'].observe(duration)
+            histograms['xvt_request_db_queries'].observe(queries)
+            histograms['xvt_request_db_duration_seconds'].observe(db_duration)
+            if size is not None:
+                histograms['xvt_response_size_bytes'].observe(size)
+            key = (route, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP xvt_requests_total Requests handled, by URL pattern, method and status')
+            lines.append('# TYPE xvt_requests_total counter')
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'xvt_requests_total{{route="{_escape(route)}",method="{method}",status="{status}"}} {count}')
+
+            for name, help_text, _ in HISTOGRAMS:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (route, method), histograms in sorted(self._histograms.items()):
+                    histogram = histograms[name]
+                    labels = f'route="{_escape(route)}",method="{method}"'
+                    for bound, count in histogram.cumulative():
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._requests.clear()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def metrics_view(request):
+    # Only served to the addresses in METRICS_ALLOWED_IPS (localhost by default)
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
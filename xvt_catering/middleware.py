@@ -0,0 +1,77 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+
+from xvt_catering.metrics import registry
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetricsMiddleware:
+    """Record wall time, DB queries, DB time and response size per URL pattern.
+
+    Queries run while a streaming response is being consumed happen after the
+    middleware returns and are not counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            _record_queries(stack, recorder)
+            response = self.get_response(request)
+        self._observe(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    async def __acall__(self, request):
+        # The async ORM runs queries on the request's sync thread, whose connections
+        # are not the event loop's, so the recorder is installed over there
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(_record_queries)(stack, recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self._observe(request, response, time.perf_counter() - started, recorder)
+        return response
+
+    def _observe(self, request, response, duration, recorder):
+        match = request.resolver_match
+        route = match.route if match is not None else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        registry.observe(route, request.method, response.status_code, duration, recorder.count,
+                         recorder.duration, size)
+
+
+def _record_queries(stack, recorder):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'xvt_catering.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +86,19 @@ DATABASES = {
     }
 }
 
+# Cache
+# The local-memory cache is per process. With several workers use a shared backend
+# (Redis, Memcached) so shopping list invalidations reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -130,10 +144,39 @@ AUTH_USER_MODEL = 'accounts.CustomUser' #Allows all apps to use CustomUser from
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     )
 }
 
+# Seconds CachedJWTAuthentication keeps the user behind a token (dropped on user save or delete)
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Number of NDJSON lines committed per transaction by /api/bulk/import/
+BULK_IMPORT_CHUNK_SIZE = 500
+
+# Rows fetched per database round-trip by the streaming export endpoints
+EXPORT_CHUNK_SIZE = 2000
+
+# Seconds a per-user shopping list stays cached (it is invalidated on writes anyway)
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+
+# Serialized recipes kept per process (food_manager.caching.recipe_representations),
+# optionally backed by a CACHES entry shared between processes, e.g. Redis or memcached
+REPRESENTATION_CACHE_MAX_ENTRIES = 5000
+REPRESENTATION_SHARED_CACHE = None
+REPRESENTATION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Ingredient and recipe name search (food_manager.search): seconds between full
+# rebuilds of the in-process index, the trigram similarity a search match needs,
+# and the similarity at which a new name counts as a duplicate of an existing one
+SEARCH_INDEX_TTL = 5 * 60
+SEARCH_MIN_SIMILARITY = 0.3
+NAME_SIMILARITY_THRESHOLD = 0.7
+
+# Most branch and bound nodes the pack optimizer (food_manager.packs) visits per
+# ingredient, it returns the best basket found so far once they are used up
+PACK_PLAN_MAX_NODES = 10_000
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=180),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=50),
@@ -168,6 +211,18 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Clients allowed to scrape the per-endpoint request metrics at /api/metrics
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Request tracing, see food_manager.tracing. Sample rates are per endpoint (view name).
+TRACING = {
+    'ENABLED': os.environ.get('DJANGO_TRACING', '') == '1',
+    'DEFAULT_SAMPLE_RATE': 0.01,
+    'SAMPLE_RATES': {
+        'ingredient_list': 0.05,
+    },
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -178,6 +233,11 @@ LOGGING = {
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',
+        'level': os.environ.get('DJANGO_LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        'food_manager.trace': {
+            'level': 'INFO',
+        },
     },
 }
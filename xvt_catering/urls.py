@@ -17,10 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, re_path, include
 import food_manager.api as fm
+from xvt_catering.metrics import metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/metrics', metrics_view),
     path('api/', include('food_manager.api.urls'))
 
 ]